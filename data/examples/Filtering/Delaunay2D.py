@@ -1,9 +1,11 @@
 #!/usr/bin/python3
 
+import numpy as np
 # noinspection PyUnresolvedReferences
 import vtkmodules.vtkInteractionStyle
 # noinspection PyUnresolvedReferences
 import vtkmodules.vtkRenderingOpenGL2
+from vtkmodules.util.numpy_support import numpy_to_vtk
 from vtkmodules.vtkCommonColor import vtkNamedColors
 from vtkmodules.vtkCommonCore import vtkPoints
 from vtkmodules.vtkCommonDataModel import vtkPolyData
@@ -23,12 +25,13 @@ def main():
 
     # Create a set of heights on a grid.
     # This is often called a "terrain map".
-    points = vtkPoints()
-
     grid_size = 10
-    for x in range(grid_size):
-        for y in range(grid_size):
-            points.InsertNextPoint(x, y, int((x + y) / (y + 1)))
+    xs, ys = np.meshgrid(np.arange(grid_size), np.arange(grid_size), indexing='ij')
+    zs = (xs + ys) // (ys + 1)
+    pts = np.stack([xs, ys, zs], axis=-1).reshape(-1, 3).astype(np.float64)
+
+    points = vtkPoints()
+    points.SetData(numpy_to_vtk(pts, deep=True))
 
     # Add the grid points to a polydata object.
     polydata = vtkPolyData()
@@ -47,7 +50,6 @@ def main():
     mesh_actor.GetProperty().EdgeVisibilityOn()
     mesh_actor.GetProperty().SetEdgeColor(colors.GetColor3d('CornflowerBlue'))
     mesh_actor.GetProperty().SetLineWidth(3)
-    mesh_actor.GetProperty().RenderLinesAsTubesOn()
 
     glyph_filter = vtkVertexGlyphFilter()
     glyph_filter.SetInputData(polydata)
@@ -59,11 +61,14 @@ def main():
     point_actor.SetMapper(point_mapper)
     point_actor.GetProperty().SetColor(colors.GetColor3d('DeepPink'))
     point_actor.GetProperty().SetPointSize(10)
-    point_actor.GetProperty().RenderPointsAsSpheresOn()
 
     renderer = vtkRenderer()
     renderer.SetBackground(colors.GetColor3d('PowderBlue'))
+    # Smooth the edges and points with FXAA instead of drawing them as tubes and spheres.
+    renderer.UseFXAAOn()
     render_window = vtkRenderWindow()
+    # FXAA replaces multisampling.
+    render_window.SetMultiSamples(0)
     render_window.SetSize(600, 600)
     render_window.SetWindowName('Delaunay2D')
     render_window.AddRenderer(renderer)
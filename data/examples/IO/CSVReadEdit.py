@@ -1,36 +1,36 @@
 #!/usr/bin/env python3
 
+import math
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
-# noinspection PyUnresolvedReferences
-import vtkmodules.vtkInteractionStyle
-# noinspection PyUnresolvedReferences
-import vtkmodules.vtkRenderingOpenGL2
 from vtk.util import numpy_support
 from vtkmodules.vtkCommonColor import (
     vtkNamedColors
 )
-from vtkmodules.vtkCommonCore import vtkLookupTable, vtkPoints
+from vtkmodules.vtkCommonCore import (
+    VTK_DOUBLE,
+    VTK_UNSIGNED_CHAR,
+    vtkLookupTable,
+    vtkPoints
+)
 from vtkmodules.vtkCommonDataModel import (
     vtkCellArray,
-    vtkPolyData,
-    vtkPolyLine
+    vtkPolyData
 )
-from vtkmodules.vtkCommonTransforms import vtkTransform
-from vtkmodules.vtkFiltersGeneral import vtkTransformPolyDataFilter
 from vtkmodules.vtkIOXML import vtkXMLPolyDataWriter
-from vtkmodules.vtkInteractionStyle import vtkInteractorStyleTrackballCamera
-from vtkmodules.vtkInteractionWidgets import vtkCameraOrientationWidget, vtkOrientationMarkerWidget
-from vtkmodules.vtkRenderingAnnotation import vtkAxesActor, vtkScalarBarActor
-from vtkmodules.vtkRenderingCore import (
-    vtkActor,
-    vtkColorTransferFunction,
-    vtkPolyDataMapper,
-    vtkRenderWindow,
-    vtkRenderWindowInteractor,
-    vtkRenderer
-)
+
+# The rendering modules are imported in main() only when rendering is requested.
+
+# Use the multithreaded Arrow CSV parser if pyarrow is available.
+try:
+    import pyarrow  # noqa: F401
+
+    CSV_ENGINE = 'pyarrow'
+except ImportError:
+    CSV_ENGINE = 'c'
 
 
 def get_program_parameters():
@@ -55,13 +55,18 @@ def get_program_parameters():
     group.add_argument('-e', '--ecef', action='store_true', help='Use ECEF coordinates.')
     group.add_argument('-u', '--utm', action='store_true', help='Use UTM coordinates.')
     group.add_argument('-g', '--geo', action='store_true', help='Use geographic coordinates (latitude/longitude).')
+    parser.add_argument('-m', '--max-points', type=int, default=100000,
+                        help='The maximum number of points to render, the .vtp file keeps full resolution.')
+    parser.add_argument('-n', '--no-render', action='store_true',
+                        help='Only save the requested files, do not visualise the result.')
 
     args = parser.parse_args()
-    return args.file_name, args.csv, args.vtp, args.path, args.ecef, args.utm, args.geo
+    return (args.file_name, args.csv, args.vtp, args.path, args.ecef, args.utm, args.geo, args.max_points,
+            args.no_render)
 
 
 def main():
-    ifn, csv, vtp, sp, ecef, utm, geo = get_program_parameters()
+    ifn, csv, vtp, sp, ecef, utm, geo, max_points, no_render = get_program_parameters()
     file_name = Path(ifn)
     if not file_name.is_file():
         print('Unable to read:', file_name)
@@ -74,15 +79,23 @@ def main():
     pth.mkdir(parents=True, exist_ok=True)
 
     # Build the output paths.
-    csv_fn = Path(pth / Path(ifn).stem).with_suffix('.csv')
-    vtp_fn = Path(pth / Path(ifn).stem).with_suffix('.vtp')
+    stem = file_name.stem
+    suffix = 'ecef' if ecef else 'utm' if utm else 'geo'
+    csv_fn = pth / f'{stem}_{suffix}.csv'
+    vtp_fn = pth / f'{stem}_{suffix}.vtp'
+
+    # Only parse the columns that are needed for the selected coordinates.
     if ecef:
-        vtp_fn = vtp_fn.with_stem(vtp_fn.stem + '_ecef')
-    if utm:
-        vtp_fn = vtp_fn.with_stem(vtp_fn.stem + '_utm')
+        columns = ['X(m)', 'Y(m)', 'Z(m)', 'Elevation(m)']
+    elif utm:
+        columns = ['Easting(m)', 'Northing(m)', 'Elevation(m)']
+    else:
+        columns = ['Longitude', 'Latitude', 'Elevation(m)']
+    use_cols = ['Index', 'Latitude'] + [c for c in columns if c != 'Latitude']
 
     # Create a DataFrame from the csv file.
-    df = pd.read_csv(file_name)
+    df = pd.read_csv(file_name, usecols=use_cols, dtype={c: np.float64 for c in use_cols if c != 'Index'},
+                     engine=CSV_ENGINE)
 
     # Use the column called 'Index' as the index.
     # This ensures that we can trace back each row to the original data.
@@ -90,8 +103,8 @@ def main():
 
     # For ECEF coordinates, we want to look down from the zenith.
     # So calculate the mid-point of the latitude.
-    lat_details = df['Latitude'].describe()
-    lat_mid_pt = (lat_details['max'] + lat_details['min']) / 2
+    lat_min, lat_max = df['Latitude'].agg(['min', 'max'])
+    lat_mid_pt = (lat_max + lat_min) / 2
 
     dfv = None
     # Copy what we want to a new DataFrame and drop any rows with missing values.
@@ -99,91 +112,70 @@ def main():
         dfv = df[['X(m)', 'Y(m)', 'Z(m)', 'Elevation(m)']].dropna(
             subset=['X(m)', 'Y(m)', 'Z(m)'])
         if csv:
-            ecef_csv_fn = csv_fn.with_stem(csv_fn.stem + '_ecef')
-            dfv.to_csv(ecef_csv_fn, index=True, index_label='Index', header=True)
+            dfv.to_csv(csv_fn, index=True, index_label='Index', header=True)
     elif utm:
         dfv = df[['Easting(m)', 'Northing(m)', 'Elevation(m)']].dropna(
             subset=['Easting(m)', 'Northing(m)', 'Elevation(m)'])
-        # Duplicate the elevation column, this will become the z-coordinate when UTM is selected.
-        dfv['Elev'] = dfv.loc[:, 'Elevation(m)']
         if csv:
-            utm_csv_fn = csv_fn.with_stem(csv_fn.stem + '_utm')
-            dfv.to_csv(utm_csv_fn, index=True, index_label='Index', header=True)
+            dfv.to_csv(csv_fn, index=True, index_label='Index', header=True)
     else:
         df_geo = df[['Longitude', 'Latitude', 'Elevation(m)']].dropna(
             subset=['Longitude', 'Latitude', 'Elevation(m)'])
-        geo_csv_fn = csv_fn.with_stem(csv_fn.stem + '_geo')
-        df_geo.to_csv(geo_csv_fn, index=True, index_label='Index', header=True)
+        df_geo.to_csv(csv_fn, index=True, index_label='Index', header=True)
 
     if ecef:
-        xyz = dfv[['X(m)', 'Y(m)', 'Z(m)']].to_numpy()
+        xyz = rotate_ecef(dfv[['X(m)', 'Y(m)', 'Z(m)']].to_numpy(), lat_mid_pt)
     elif utm:
-        xyz = dfv[['Easting(m)', 'Northing(m)', 'Elevation(m)']].to_numpy()
+        # The elevation becomes the z-coordinate.
+        xyz = np.column_stack([dfv['Easting(m)'].to_numpy(), dfv['Northing(m)'].to_numpy(),
+                               dfv['Elevation(m)'].to_numpy()])
     else:
         print('Only ECEF or UTM coordinates can be visualised.')
         return
 
-    elev = df[['Elevation(m)']].to_numpy()
-
-    # Create the poly data.
-    poly_data = vtkPolyData()
-    points = vtkPoints()
-    points.SetData(numpy_support.numpy_to_vtk(xyz))
-    poly_data.SetPoints(points)
+    # Use the rows in dfv so that the number of values matches the number of points.
+    elev = dfv['Elevation(m)'].to_numpy()
 
-    # Set an index
-    idx = numpy_support.numpy_to_vtk(elev)
-    idx.SetName('Index')
-    poly_data.GetPointData().AddArray(idx)
-
-    # We use the elevation as the active scalars.
-    scal = numpy_support.numpy_to_vtk(elev)
-    scal.SetName('Elevation(m)')
-    poly_data.GetPointData().SetScalars(scal)
-    poly_data.GetPointData().SetActiveScalars('Elevation(m)')
+    poly_data = make_poly_data(xyz, elev)
     elev_range = poly_data.GetPointData().GetScalars().GetRange()
 
-    num_pts = poly_data.GetNumberOfPoints()
-    poly_line = vtkPolyLine()
-    poly_line.GetPointIds().SetNumberOfIds(num_pts)
-    for i in range(0, num_pts):
-        poly_line.GetPointIds().SetId(i, i)
-
-    # Create a cell array to store the lines in and add the lines to it.
-    cells = vtkCellArray()
-    cells.InsertNextCell(poly_line)
-
-    # Add the lines to the dataset
-    poly_data.SetLines(cells)
-
-    poly_data.Modified()
-
-    # Rotate the ECEF coordinates
-    # into VTK coordinates so that on the screen:
-    # Y points North, X points East and Z points up.
-    transform = vtkTransform()
-    if utm:
-        # Scale the elevation.
-        transform.Scale(1, 1, 1)
-    if ecef:
-        # Rotate the ECEF coordinates
-        # into VTK coordinates so that on the screen:
-        # Y points North, X points East and Z points up.
-        transform.RotateX(-(90 - lat_mid_pt))
-        transform.RotateY(0)
-        transform.RotateZ(90 - lat_mid_pt)
-
-    transform_filter = vtkTransformPolyDataFilter()
-    transform_filter.SetInputDataObject(poly_data)
-    transform_filter.SetTransform(transform)
-    transform_filter.Update()
-
+    # Render a decimated copy of the track if there are too many points.
+    render_poly_data = poly_data
+    num_pts = xyz.shape[0]
+    if num_pts > max_points > 0:
+        stride = math.ceil(num_pts / max_points)
+        render_poly_data = make_poly_data(xyz[::stride], elev[::stride])
+
+    # Write the .vtp file in the background while the render window is being set up.
+    #  The writer gets its own shallow copy, so it does not share the data object used by the mapper.
+    executor = None
+    vtp_future = None
     if vtp:
-        writer = vtkXMLPolyDataWriter()
-        writer.SetFileName(vtp_fn)
-        writer.SetInputConnection(transform_filter.GetOutputPort())
-        writer.SetDataModeToBinary()
-        writer.Write()
+        vtp_poly_data = vtkPolyData()
+        vtp_poly_data.ShallowCopy(poly_data)
+        executor = ThreadPoolExecutor(max_workers=1)
+        vtp_future = executor.submit(write_vtp, vtp_poly_data, vtp_fn)
+
+    if no_render:
+        if vtp_future is not None:
+            vtp_future.result()
+            executor.shutdown()
+        return
+
+    # noinspection PyUnresolvedReferences
+    import vtkmodules.vtkInteractionStyle
+    # noinspection PyUnresolvedReferences
+    import vtkmodules.vtkRenderingOpenGL2
+    from vtkmodules.vtkInteractionStyle import vtkInteractorStyleTrackballCamera
+    from vtkmodules.vtkInteractionWidgets import vtkCameraOrientationWidget, vtkOrientationMarkerWidget
+    from vtkmodules.vtkRenderingAnnotation import vtkAxesActor, vtkScalarBarActor
+    from vtkmodules.vtkRenderingCore import (
+        vtkActor,
+        vtkPolyDataMapper,
+        vtkRenderWindow,
+        vtkRenderWindowInteractor,
+        vtkRenderer
+    )
 
     colors = vtkNamedColors()
     colors.SetColor("ParaViewBkg", [82, 87, 110, 255])
@@ -192,7 +184,7 @@ def main():
     # lut = get_diverging_lut1('DarkRed', 'Gainsboro', 'Green')
 
     mapper = vtkPolyDataMapper()
-    mapper.SetInputConnection(transform_filter.GetOutputPort())
+    mapper.SetInputData(render_poly_data)
     mapper.SetScalarRange(elev_range)
     mapper.SetLookupTable(lut)
     mapper.ScalarVisibilityOn()
@@ -252,6 +244,11 @@ def main():
     widget.SetEnabled(1)
     widget.InteractiveOn()
 
+    # Wait for the .vtp file to be written.
+    if vtp_future is not None:
+        vtp_future.result()
+        executor.shutdown()
+
     renderer.ResetCamera()
     renderer.GetActiveCamera().Elevation(0)
 
@@ -261,6 +258,111 @@ def main():
     iren.Start()
 
 
+def write_vtp(poly_data, file_name):
+    """
+    Write the poly data as raw appended data.
+
+    LZ4 compression is used if available, otherwise ZLib at the fastest compression level.
+
+    :param poly_data: The poly data to write.
+    :param file_name: The .vtp file name.
+    :return:
+    """
+    writer = vtkXMLPolyDataWriter()
+    writer.SetFileName(file_name)
+    writer.SetInputData(poly_data)
+    writer.SetDataModeToAppended()
+    writer.SetEncodeAppendedData(False)
+    if hasattr(writer, 'SetCompressorTypeToLZ4'):
+        writer.SetCompressorTypeToLZ4()
+    else:
+        writer.SetCompressorTypeToZLib()
+        writer.SetCompressionLevel(1)
+    writer.Write()
+
+
+# The NumPy dtype matching vtkIdType.
+ID_TYPE = numpy_support.get_numpy_array_type(numpy_support.VTK_ID_TYPE)
+
+
+def make_poly_data(xyz, elev):
+    """
+    Create a poly data object with a single polyline through the points.
+
+    :param xyz: The (N, 3) array of point coordinates.
+    :param elev: The (N,) array of elevations.
+    :return: The poly data.
+    """
+    # Ensure C-contiguous float64 arrays so that VTK wraps the NumPy buffers without copying them.
+    xyz = np.ascontiguousarray(xyz, dtype=np.float64)
+    elev = np.ascontiguousarray(elev, dtype=np.float64)
+
+    poly_data = vtkPolyData()
+    points = vtkPoints()
+    points.SetData(numpy_support.numpy_to_vtk(xyz, deep=False, array_type=VTK_DOUBLE))
+    poly_data.SetPoints(points)
+
+    # Set an index
+    idx = numpy_support.numpy_to_vtk(elev, deep=False, array_type=VTK_DOUBLE)
+    idx.SetName('Index')
+    poly_data.GetPointData().AddArray(idx)
+
+    # We use the elevation as the active scalars.
+    scal = numpy_support.numpy_to_vtk(elev, deep=False, array_type=VTK_DOUBLE)
+    scal.SetName('Elevation(m)')
+    poly_data.GetPointData().SetScalars(scal)
+    poly_data.GetPointData().SetActiveScalars('Elevation(m)')
+
+    # A single polyline through all the points, described by its offsets and connectivity.
+    num_pts = poly_data.GetNumberOfPoints()
+    offsets = np.array([0, num_pts], dtype=ID_TYPE)
+    conn = np.arange(num_pts, dtype=ID_TYPE)
+
+    # Create a cell array to store the lines in and hand it both arrays without copying them.
+    cells = vtkCellArray()
+    cells.SetData(numpy_support.numpy_to_vtkIdTypeArray(offsets, deep=False),
+                  numpy_support.numpy_to_vtkIdTypeArray(conn, deep=False))
+
+    # Add the lines to the dataset
+    poly_data.SetLines(cells)
+
+    return poly_data
+
+
+def rotate_ecef(xyz, lat_mid_pt):
+    """
+    Rotate the ECEF coordinates into VTK coordinates so that on the screen:
+    Y points North, X points East and Z points up.
+
+    This is the same as applying RotateX(-(90 - lat_mid_pt)) then RotateZ(90 - lat_mid_pt)
+    with a vtkTransform, but the two rotations are composed into a single 3x3 matrix
+    and applied to all the points at once.
+
+    :param xyz: The (N, 3) array of ECEF coordinates.
+    :param lat_mid_pt: The mid-point of the latitude in degrees.
+    :return: The rotated (N, 3) array.
+    """
+    ax = np.radians(-(90 - lat_mid_pt))
+    az = np.radians(90 - lat_mid_pt)
+    rx = np.array([[1.0, 0.0, 0.0],
+                   [0.0, np.cos(ax), -np.sin(ax)],
+                   [0.0, np.sin(ax), np.cos(ax)]])
+    rz = np.array([[np.cos(az), -np.sin(az), 0.0],
+                   [np.sin(az), np.cos(az), 0.0],
+                   [0.0, 0.0, 1.0]])
+    return np.asarray(xyz, dtype=np.float64) @ (rx @ rz).T
+
+
+# The (start, mid, end) colors of the diverging color maps.
+_COLOR_MAPS = {
+    'cool_warm': ((0.230, 0.299, 0.754), (0.865, 0.865, 0.865), (0.706, 0.016, 0.150)),
+    'purple_orange': ((0.436, 0.308, 0.631), (0.865, 0.865, 0.865), (0.759, 0.334, 0.046)),
+    'green_purple': ((0.085, 0.532, 0.201), (0.865, 0.865, 0.865), (0.436, 0.308, 0.631)),
+    'blue_brown': ((0.217, 0.525, 0.910), (0.865, 0.865, 0.865), (0.677, 0.492, 0.093)),
+    'green_red': ((0.085, 0.532, 0.201), (0.865, 0.865, 0.865), (0.758, 0.214, 0.233)),
+}
+
+
 def get_diverging_lut(color_map: str, table_size: int = 256):
     """
     See: [Diverging Color Maps for Scientific Visualization](https://www.kennethmoreland.com/color-maps/)
@@ -275,36 +377,18 @@ def get_diverging_lut(color_map: str, table_size: int = 256):
     :param table_size: The table size.
     :return:
     """
-    color_maps = dict()
-    color_maps['cool_warm'] = {'start': (0.230, 0.299, 0.754), 'mid': (0.865, 0.865, 0.865),
-                               'end': (0.706, 0.016, 0.150)}
-    color_maps['purple_orange'] = {'start': (0.436, 0.308, 0.631), 'mid': (0.865, 0.865, 0.865),
-                                   'end': (0.759, 0.334, 0.046)}
-    color_maps['green_purple'] = {'start': (0.085, 0.532, 0.201), 'mid': (0.865, 0.865, 0.865),
-                                  'end': (0.436, 0.308, 0.631)}
-    color_maps['blue_brown'] = {'start': (0.217, 0.525, 0.910), 'mid': (0.865, 0.865, 0.865),
-                                'end': (0.677, 0.492, 0.093)}
-    color_maps['green_red'] = {'start': (0.085, 0.532, 0.201), 'mid': (0.865, 0.865, 0.865),
-                               'end': (0.758, 0.214, 0.233)}
+    from vtkmodules.vtkRenderingCore import vtkColorTransferFunction
+
+    start, mid, end = _COLOR_MAPS[color_map]
 
     ctf = vtkColorTransferFunction()
     ctf.SetColorSpaceToDiverging()
-    cm = color_maps[color_map]
-
-    ctf.AddRGBPoint(0.0, *cm['start'])
-    ctf.AddRGBPoint(0.5, *cm['mid'])
-    ctf.AddRGBPoint(1.0, *cm['end'])
-
-    lut = vtkLookupTable()
-    lut.SetNumberOfTableValues(table_size)
-    lut.Build()
 
-    for i in range(0, table_size):
-        rgba = list(ctf.GetColor(float(i) / table_size))
-        rgba.append(1)
-        lut.SetTableValue(i, rgba)
+    ctf.AddRGBPoint(0.0, *start)
+    ctf.AddRGBPoint(0.5, *mid)
+    ctf.AddRGBPoint(1.0, *end)
 
-    return lut
+    return ctf_to_lut(ctf, table_size)
 
 
 def get_diverging_lut1(start: str, mid: str, end: str, table_size: int = 256):
@@ -317,6 +401,8 @@ def get_diverging_lut1(start: str, mid: str, end: str, table_size: int = 256):
     :param table_size:  The table size.
     :return:
     """
+    from vtkmodules.vtkRenderingCore import vtkColorTransferFunction
+
     colors = vtkNamedColors()
     # Colour transfer function.
     ctf = vtkColorTransferFunction()
@@ -328,14 +414,29 @@ def get_diverging_lut1(start: str, mid: str, end: str, table_size: int = 256):
     ctf.AddRGBPoint(*p2)
     ctf.AddRGBPoint(*p3)
 
+    return ctf_to_lut(ctf, table_size)
+
+
+def ctf_to_lut(ctf, table_size: int = 256):
+    """
+    Sample a color transfer function into an opaque lookup table.
+
+    The transfer function is evaluated in a single call and the table is uploaded as one array.
+
+    :param ctf: The color transfer function.
+    :param table_size: The table size.
+    :return: The lookup table.
+    """
+    rgb = np.empty((table_size, 3), dtype=np.float64)
+    ctf.GetTable(0.0, 1.0, table_size, rgb.ravel())
+
+    rgba = np.empty((table_size, 4), dtype=np.uint8)
+    rgba[:, :3] = (rgb * 255.0 + 0.5).astype(np.uint8)
+    rgba[:, 3] = 255
+
     lut = vtkLookupTable()
     lut.SetNumberOfTableValues(table_size)
-    lut.Build()
-
-    for i in range(0, table_size):
-        rgba = list(ctf.GetColor(float(i) / table_size))
-        rgba.append(1)
-        lut.SetTableValue(i, rgba)
+    lut.SetTable(numpy_support.numpy_to_vtk(rgba, deep=True, array_type=VTK_UNSIGNED_CHAR))
 
     return lut
 
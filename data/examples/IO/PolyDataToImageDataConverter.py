@@ -1,5 +1,8 @@
 #!/usr/bin/env python
 
+import numpy as np
+from vtkmodules.util import numpy_support
+from vtkmodules.vtkCommonCore import VTK_UNSIGNED_CHAR
 from vtkmodules.vtkCommonDataModel import vtkImageData
 from vtkmodules.vtkIOGeometry import vtkSTLReader
 from vtkmodules.vtkIOImage import vtkMetaImageWriter
@@ -31,14 +34,19 @@ def main():
     origin_shift = pixel_padding * spacing1
     spacing = [spacing1, spacing1, spacing1]
     origin = [bounds[0] - origin_shift, bounds[2] - origin_shift, bounds[4] - origin_shift]
-    extent = [0, int((bounds[1] - bounds[0]) / spacing1) + 2 * pixel_padding, 0,
-              int((bounds[3] - bounds[2]) / spacing1) + 2 * pixel_padding, 0,
-              int((bounds[5] - bounds[4]) / spacing1) + 2 * pixel_padding]
+    # Round up so that the last layer of voxels covers the extremities of the mesh.
+    b = np.asarray(bounds)
+    sizes = np.ceil((b[1::2] - b[0::2]) / spacing1).astype(np.int64) + 2 * pixel_padding
+    extent = [0, int(sizes[0]), 0, int(sizes[1]), 0, int(sizes[2])]
 
     blank_image = vtkImageData()
     blank_image.SetExtent(extent)
-    blank_image.AllocateScalars(3, 1)  # VTK_UNSIGNED_CHAR, 1 component
-    blank_image.GetPointData().GetScalars().Fill(0)
+    # Zero-filled VTK_UNSIGNED_CHAR scalars, 1 component, wrapping a NumPy buffer.
+    dims = (extent[1] + 1, extent[3] + 1, extent[5] + 1)
+    scalars = np.zeros(dims[0] * dims[1] * dims[2], dtype=np.uint8)
+    vtk_scalars = numpy_support.numpy_to_vtk(scalars, deep=False, array_type=VTK_UNSIGNED_CHAR)
+    vtk_scalars.SetName('ImageScalars')
+    blank_image.GetPointData().SetScalars(vtk_scalars)
     blank_image.SetSpacing(spacing)
     blank_image.SetOrigin(origin)
 
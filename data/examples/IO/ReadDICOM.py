@@ -1,5 +1,7 @@
 #!/usr/bin/env python3
 
+from pathlib import Path
+
 # noinspection PyUnresolvedReferences
 import vtkmodules.vtkRenderingOpenGL2
 from vtkmodules.vtkCommonColor import vtkNamedColors
@@ -14,7 +16,7 @@ def get_program_parameters():
     epilogue = ''''''
     parser = argparse.ArgumentParser(description=description, epilog=epilogue,
                                      formatter_class=argparse.RawDescriptionHelpFormatter)
-    parser.add_argument('filename', help='prostate.img')
+    parser.add_argument('filename', help='prostate.img, or a directory containing a DICOM series.')
     args = parser.parse_args()
     return args.filename
 
@@ -24,9 +26,12 @@ def main():
 
     input_filename = get_program_parameters()
 
-    # Read the DICOM file
+    # Read the DICOM file or, if a directory is given, all the slices in it.
     reader = vtkDICOMImageReader()
-    reader.SetFileName(input_filename)
+    if Path(input_filename).is_dir():
+        reader.SetDirectoryName(input_filename)
+    else:
+        reader.SetFileName(input_filename)
     reader.Update()
 
     # Visualize
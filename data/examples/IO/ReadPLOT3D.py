@@ -5,7 +5,11 @@ import vtkmodules.vtkInteractionStyle
 # noinspection PyUnresolvedReferences
 import vtkmodules.vtkRenderingOpenGL2
 from vtkmodules.vtkCommonColor import vtkNamedColors
-from vtkmodules.vtkFiltersGeometry import vtkStructuredGridGeometryFilter
+from vtkmodules.vtkFiltersExtraction import vtkExtractBlock
+from vtkmodules.vtkFiltersGeometry import (
+    vtkCompositeDataGeometryFilter,
+    vtkStructuredGridGeometryFilter
+)
 from vtkmodules.vtkIOParallel import vtkMultiBlockPLOT3DReader
 from vtkmodules.vtkRenderingCore import (
     vtkActor,
@@ -17,7 +21,7 @@ from vtkmodules.vtkRenderingCore import (
 
 
 def main():
-    xyzFile, qFile = get_program_parameters()
+    xyzFile, qFile, byte_order = get_program_parameters()
 
     colors = vtkNamedColors()
 
@@ -26,10 +30,30 @@ def main():
     reader.SetQFileName(qFile)
     reader.SetScalarFunctionNumber(100)
     reader.SetVectorFunctionNumber(202)
-    reader.Update()
-
-    geometry = vtkStructuredGridGeometryFilter()
-    geometry.SetInputData(reader.GetOutput().GetBlock(0))
+    if byte_order == 'auto':
+        reader.AutoDetectFormatOn()
+    else:
+        # Skip the format detection, the files are known to be binary.
+        reader.AutoDetectFormatOff()
+        reader.SetBinaryFile(True)
+        if byte_order == 'little':
+            reader.SetByteOrderToLittleEndian()
+        else:
+            reader.SetByteOrderToBigEndian()
+
+    # Let the pipeline execute when the window is rendered, only block 0 is used.
+    # Flat index 0 is the root of the multiblock dataset, so block 0 is flat index 1.
+    block = vtkExtractBlock()
+    block.SetInputConnection(reader.GetOutputPort())
+    block.AddIndex(1)
+
+    # The structured grid geometry filter runs on each block of the extracted dataset,
+    #  the composite data geometry filter then merges its output into a single polydata.
+    structured_geometry = vtkStructuredGridGeometryFilter()
+    structured_geometry.SetInputConnection(block.GetOutputPort())
+
+    geometry = vtkCompositeDataGeometryFilter()
+    geometry.SetInputConnection(structured_geometry.GetOutputPort())
 
     mapper = vtkPolyDataMapper()
     mapper.SetInputConnection(geometry.GetOutputPort())
@@ -75,8 +99,10 @@ def get_program_parameters():
                                      formatter_class=argparse.RawDescriptionHelpFormatter)
     parser.add_argument('filename1', help='combxyz.bin.')
     parser.add_argument('filename2', help='combq.bin.')
+    parser.add_argument('-b', '--byte_order', choices=['auto', 'big', 'little'], default='auto',
+                        help='The byte order of the binary files, auto detects the file format.')
     args = parser.parse_args()
-    return args.filename1, args.filename2
+    return args.filename1, args.filename2, args.byte_order
 
 
 if __name__ == '__main__':
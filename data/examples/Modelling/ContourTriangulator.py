@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 
+from pathlib import Path
 
 # noinspection PyUnresolvedReferences
 import vtkmodules.vtkInteractionStyle
@@ -17,6 +18,12 @@ from vtkmodules.vtkRenderingCore import (
     vtkRenderer
 )
 
+# Resolve the named colors once.
+_COLORS = vtkNamedColors()
+ISO_COLOR = _COLORS.GetColor3d('MediumOrchid')
+POLY_COLOR = _COLORS.GetColor3d('Gray')
+BACKGROUND = _COLORS.GetColor3d('DarkSlateGray')
+
 
 def get_program_parameters():
     import argparse
@@ -35,13 +42,14 @@ def get_program_parameters():
 def main():
     file_name, iso_value = get_program_parameters()
 
-    colors = vtkNamedColors()
-
     reader = vtkPNGReader()
     if not reader.CanReadFile(file_name):
         print('Error: Could not read', file_name)
         return
-    reader.SetFileName(file_name)
+    # Read the file once and decode the image from memory.
+    buffer = Path(file_name).read_bytes()
+    reader.SetMemoryBuffer(buffer)
+    reader.SetMemoryBufferLength(len(buffer))
     reader.Update()
 
     iso = vtkMarchingSquares()
@@ -54,8 +62,7 @@ def main():
 
     iso_actor = vtkActor()
     iso_actor.SetMapper(iso_mapper)
-    iso_actor.GetProperty().SetColor(
-        colors.GetColor3d('MediumOrchid'))
+    iso_actor.GetProperty().SetColor(ISO_COLOR)
 
     poly = vtkContourTriangulator()
     poly.SetInputConnection(iso.GetOutputPort())
@@ -66,7 +73,7 @@ def main():
 
     poly_actor = vtkActor()
     poly_actor.SetMapper(poly_mapper)
-    poly_actor.GetProperty().SetColor(colors.GetColor3d('Gray'))
+    poly_actor.GetProperty().SetColor(POLY_COLOR)
 
     # Standard rendering classes.
     renderer = vtkRenderer()
@@ -80,7 +87,7 @@ def main():
 
     renderer.AddActor(poly_actor)
     renderer.AddActor(iso_actor)
-    renderer.SetBackground(colors.GetColor3d('DarkSlateGray'))
+    renderer.SetBackground(BACKGROUND)
     ren_win.SetSize(300, 300)
 
     camera = renderer.GetActiveCamera()
@@ -1,5 +1,7 @@
 #!/usr/bin/env python3
 
+from functools import partial
+
 # noinspection PyUnresolvedReferences
 import vtkmodules.vtkInteractionStyle
 # noinspection PyUnresolvedReferences
@@ -18,10 +20,16 @@ from vtkmodules.vtkRenderingCore import (
     vtkRenderer
 )
 
+# Resolve the named colors once.
+_COLORS = vtkNamedColors()
+SLAB_BACK = _COLORS.GetColor3d('Sienna')
+SLAB_DIFFUSE = _COLORS.GetColor3d('BurlyWood')
+SLAB_EDGE = _COLORS.GetColor3d('PapayaWhip')
+BG0 = _COLORS.GetColor3d('DarkSlateGray')
+BG1 = _COLORS.GetColor3d('MidnightBlue')
 
-def generate_and_display_cube_and_axes():
-    colors = vtkNamedColors()
 
+def generate_and_display_cube_and_axes():
     # Make the slab and axes actors.
     cube_source = vtkCubeSource()
     cube_source.SetXLength(4.0)
@@ -33,14 +41,14 @@ def generate_and_display_cube_and_axes():
     cube_mapper.SetInputConnection(cube_source.GetOutputPort())
 
     back = vtkProperty()
-    back.SetColor(colors.GetColor3d('Sienna'))
+    back.SetColor(SLAB_BACK)
 
     cube_actor = vtkActor()
-    cube_actor.GetProperty().SetDiffuseColor(colors.GetColor3d('BurlyWood'))
+    cube_actor.GetProperty().SetDiffuseColor(SLAB_DIFFUSE)
     cube_actor.SetMapper(cube_mapper)
     cube_actor.GetProperty().EdgeVisibilityOn()
     cube_actor.GetProperty().SetLineWidth(2.0)
-    cube_actor.GetProperty().SetEdgeColor(colors.GetColor3d('PapayaWhip'))
+    cube_actor.GetProperty().SetEdgeColor(SLAB_EDGE)
     cube_actor.SetBackfaceProperty(back)
 
     transform = vtkTransform()
@@ -69,127 +77,69 @@ def generate_and_display_cube_and_axes():
         renderers[i].SetLayer(i)
 
     # Layer 0 - background not transparent.
-    renderers[0].SetBackground(colors.GetColor3d('DarkSlateGray'))
+    renderers[0].SetBackground(BG0)
     renderers[0].AddActor(cube_actor)
     renderers[0].SetLayer(0)
     # Layer 1 - the background is transparent,
     #           so we only see the layer 0 background color
     renderers[1].AddActor(axes)
-    renderers[1].SetBackground(colors.GetColor3d('MidnightBlue'))
+    renderers[1].SetBackground(BG1)
     renderers[1].SetLayer(1)
 
-    # Set a common camera view for each layer.
-    for renderer in renderers:
-        camera = renderer.GetActiveCamera()
-        camera.Elevation(-30)
-        camera.Azimuth(-30)
-        renderer.ResetCamera()
+    # Both layers share the same camera, so objects in all layers move together.
+    #  The camera is reset to the slab, so scale the axes to fill the view as the slab does.
+    transform.Scale([bounding_radius(cube_actor.GetBounds()) / bounding_radius(axes.GetBounds())] * 3)
+    camera = renderers[0].GetActiveCamera()
+    renderers[1].SetActiveCamera(camera)
+    camera.Elevation(-30)
+    camera.Azimuth(-30)
+    renderers[0].ResetCamera()
 
     #  We have two layers.
     ren_win.SetNumberOfLayers(len(renderers))
 
     ren_win.Render()
 
-    iren.AddObserver('KeyPressEvent', select_layer)
-    iren.AddObserver('EndInteractionEvent', orient_layer)
+    # Bind the style and the renderers once, rather than looking them up on every key press.
+    iren.AddObserver('KeyPressEvent', partial(select_layer, style=style, ren0=renderers[0], ren1=renderers[1]))
 
     iren.Start()
 
 
-def select_layer(caller, ev):
+def bounding_radius(bounds):
+    """
+    The radius of the sphere enclosing the bounds, as used when resetting the camera.
+
+    :param bounds: The bounds.
+    :return: The radius.
+    """
+    return 0.5 * sum((bounds[2 * i + 1] - bounds[2 * i]) ** 2 for i in range(3)) ** 0.5
+
+
+def select_layer(caller, ev, style, ren0, ren1):
     """
     Select the layer to manipulate.
     :param caller:
     :param ev:
+    :param style: The interactor style.
+    :param ren0: The renderer in layer 0.
+    :param ren1: The renderer in layer 1.
     :return:
     """
-    iren = caller
-    renderers = iren.GetRenderWindow().GetRenderers()
-    if renderers.GetNumberOfItems() < 2:
-        print('We need at least two renderers, we have only', renderers.GetNumberOfItems())
-        return
-    renderers.InitTraversal()
-    # Top item.
-    ren0 = renderers.GetNextItem()
-    # Bottom item.
-    ren1 = renderers.GetNextItem()
-
-    key = iren.GetKeySym()
+    key = caller.GetKeySym()
 
     if key in ['0', 'KP_0']:
         print('Selected layer:', key)
-        iren.GetRenderWindow().GetInteractor().GetInteractorStyle().SetDefaultRenderer(ren0)
+        style.SetDefaultRenderer(ren0)
         ren0.InteractiveOn()
         ren1.InteractiveOff()
     if key in ['1', 'KP_1']:
         print('Selected layer:', key)
-        iren.GetRenderWindow().GetInteractor().GetInteractorStyle().SetDefaultRenderer(ren1)
+        style.SetDefaultRenderer(ren1)
         ren0.InteractiveOff()
         ren1.InteractiveOn()
 
 
-def orient_layer(caller, ev):
-    """
-    Orient layer 0 based on the camera orientation in layer 1 or vice versa.
-
-    :param caller:
-    :param ev:
-    :return:
-    """
-
-    iren = caller
-    renderers = iren.GetRenderWindow().GetRenderers()
-    if renderers.GetNumberOfItems() < 2:
-        print('We need at least two renderers, we have only', renderers.GetNumberOfItems())
-        return
-    renderers.InitTraversal()
-    # Top item.
-    ren0 = renderers.GetNextItem()
-    # Bottom item.
-    ren1 = renderers.GetNextItem()
-
-    if ren1.GetInteractive():
-        orient1 = get_orientation(ren1)
-        set_orientation(ren0, orient1)
-        ren0.ResetCamera()
-    else:
-        orient0 = get_orientation(ren0)
-        set_orientation(ren1, orient0)
-        ren1.ResetCamera()
-
-
-def get_orientation(ren):
-    """
-    Get the camera orientation.
-    :param ren: The renderer.
-    :return: The orientation parameters.
-    """
-    p = dict()
-    camera = ren.GetActiveCamera()
-    p['position'] = camera.GetPosition()
-    p['focal point'] = camera.GetFocalPoint()
-    p['view up'] = camera.GetViewUp()
-    p['distance'] = camera.GetDistance()
-    p['clipping range'] = camera.GetClippingRange()
-    p['orientation'] = camera.GetOrientation()
-    return p
-
-
-def set_orientation(ren, p):
-    """
-    Set the orientation of the camera.
-    :param ren: The renderer.
-    :param p: The orientation parameters.
-    :return:
-    """
-    camera = ren.GetActiveCamera()
-    camera.SetPosition(p['position'])
-    camera.SetFocalPoint(p['focal point'])
-    camera.SetViewUp(p['view up'])
-    camera.SetDistance(p['distance'])
-    camera.SetClippingRange(p['clipping range'])
-
-
 def main():
     generate_and_display_cube_and_axes()
 
@@ -1,68 +1,84 @@
 #!/usr/bin/env python3
 
-# noinspection PyUnresolvedReferences
-import vtkmodules.vtkInteractionStyle
-# noinspection PyUnresolvedReferences
-import vtkmodules.vtkRenderingOpenGL2
+import sys
+
+import numpy as np
+from vtkmodules.util.numpy_support import (
+    numpy_to_vtk,
+    vtk_to_numpy
+)
 from vtkmodules.vtkCommonColor import vtkNamedColors
 from vtkmodules.vtkCommonCore import vtkPoints
-from vtkmodules.vtkCommonDataModel import vtkStructuredGrid
-from vtkmodules.vtkFiltersGeometry import vtkStructuredGridGeometryFilter
-from vtkmodules.vtkRenderingCore import (
-    vtkActor,
-    vtkDataSetMapper,
-    vtkRenderWindow,
-    vtkRenderWindowInteractor,
-    vtkRenderer
+from vtkmodules.vtkCommonDataModel import (
+    vtkDataSetAttributes,
+    vtkStructuredGrid
 )
+from vtkmodules.vtkFiltersGeometry import vtkStructuredGridGeometryFilter
+
+# The rendering modules are imported where they are used.
 
 
 def main():
     colors = vtkNamedColors()
 
-    points = vtkPoints()
-
     grid_size = 8
-    counter = 0
-    pt_idx = 0
-    # Create a 5x5 grid of points
-    for j in range(0, grid_size):
-        for i in range(0, grid_size):
-            if i == 3 and j == 3:  # Make one point higher than the rest.
-                points.InsertNextPoint(i, j, 2)
-                print(f'The different point is number {counter}.')
-                pt_idx = counter
-            else:
-                # Make most of the points the same height.
-                points.InsertNextPoint(i, j, 0)
-            counter += 1
+    # Create a grid_size x grid_size grid of points, i varies fastest.
+    i, j = np.meshgrid(np.arange(grid_size), np.arange(grid_size), indexing='xy')
+    # Make most of the points the same height.
+    z = np.zeros_like(i)
+    # Make one point higher than the rest.
+    z[3, 3] = 2
+    pt_idx = 3 * grid_size + 3
+
+    pts = np.stack([i.ravel(), j.ravel(), z.ravel()], axis=1).astype(np.float64)
+    points = vtkPoints()
+    points.SetData(numpy_to_vtk(pts, deep=True))
 
     structured_grid = vtkStructuredGrid()
     # Specify the dimensions of the grid, set the points and blank one point.
     structured_grid.SetDimensions(grid_size, grid_size, 1)
     structured_grid.SetPoints(points)
+    # BlankPoint() sets the hidden bit of the point in the point ghost array.
+    #  To blank many points, that array can instead be filled with NumPy and
+    #  added to the point data in one go.
     structured_grid.BlankPoint(pt_idx)
 
-    # Check.
-    def is_visible(pt_num):
-        if structured_grid.IsPointVisible(pt_num):
-            return f'Point {pt_num:2d} is visible.'
-        else:
-            return f'Point {pt_num:2d} is not visible.'
-
-    # Should not be visible.
-    print(is_visible(pt_idx))
-    # Should be visible.
-    print(is_visible(7))
+    # Check, the different point should not be visible and point 7 should be.
+    lines = [f'The different point is number {pt_idx}.']
+    for pt_num in (pt_idx, 7):
+        state = 'visible' if structured_grid.IsPointVisible(pt_num) else 'not visible'
+        lines.append(f'Point {pt_num:2d} is {state}.')
+    sys.stdout.write('\n'.join(lines) + '\n')
 
     # We need the geometry filter to ensure that the
     # blanked point and surrounding faces is missing.
     geometry_filter = vtkStructuredGridGeometryFilter()
     geometry_filter.SetInputData(structured_grid)
+    # Restrict the filter to the extent of the visible points, any region
+    #  outside it has no visible points and need not be traversed.
+    ghosts = vtk_to_numpy(structured_grid.GetPointGhostArray())
+    visible = (ghosts & vtkDataSetAttributes.HIDDENPOINT) == 0
+    jj, ii = np.nonzero(visible.reshape(grid_size, grid_size))
+    geometry_filter.SetExtent(ii.min(), ii.max(), jj.min(), jj.max(), 0, 0)
+    geometry_filter.Update()
+
+    # noinspection PyUnresolvedReferences
+    import vtkmodules.vtkInteractionStyle
+    # noinspection PyUnresolvedReferences
+    import vtkmodules.vtkRenderingOpenGL2
+    from vtkmodules.vtkRenderingCore import (
+        vtkActor,
+        vtkDataSetMapper,
+        vtkRenderWindow,
+        vtkRenderWindowInteractor,
+        vtkRenderer
+    )
 
     # Create a mapper and actor.
+    # The input does not change, so the mapper can skip the pipeline checks on each render.
     grid_mapper = vtkDataSetMapper()
     grid_mapper.SetInputConnection(geometry_filter.GetOutputPort())
+    grid_mapper.StaticOn()
 
     grid_actor = vtkActor()
     grid_actor.SetMapper(grid_mapper)
@@ -1,26 +1,26 @@
 #!/usr/bin/env python
 
-import collections
-
-# noinspection PyUnresolvedReferences
-import vtkmodules.vtkInteractionStyle
-# noinspection PyUnresolvedReferences
-import vtkmodules.vtkRenderingOpenGL2
+import numpy as np
+from vtkmodules.util.numpy_support import vtk_to_numpy
 from vtkmodules.vtkCommonColor import vtkNamedColors
+from vtkmodules.vtkCommonMath import vtkMatrix4x4
 from vtkmodules.vtkCommonDataModel import (
     vtkCellTypes,
     vtkPlane
 )
 from vtkmodules.vtkCommonTransforms import vtkTransform
+from vtkmodules.vtkFiltersCore import vtkAppendFilter
+from vtkmodules.vtkFiltersExtraction import vtkExtractGeometry
 from vtkmodules.vtkFiltersGeneral import vtkClipDataSet
+from vtkmodules.vtkFiltersGeometry import vtkGeometryFilter
 from vtkmodules.vtkIOLegacy import vtkUnstructuredGridReader
-from vtkmodules.vtkRenderingCore import (
-    vtkActor,
-    vtkDataSetMapper,
-    vtkRenderWindow,
-    vtkRenderWindowInteractor,
-    vtkRenderer
-)
+
+# The rendering and VTK-m modules are imported where they are used,
+#  so that --help does not have to load them.
+
+
+# Cell edges are only drawn for outputs with fewer cells than this.
+MAX_EDGE_CELLS = 200_000
 
 
 def get_program_parameters():
@@ -31,32 +31,49 @@ def get_program_parameters():
  The resulting output and clipped output are presented in yellow and red respectively.
  To illustrate the clipped interfaces, the example uses a vtkTransform to rotate each
     output about their centers.
- Note: This clipping filter does not retain the original cells if they are not clipped.
+ Note: Only the cells straddling the plane are clipped, the others are kept as they are.
    '''
     parser = argparse.ArgumentParser(description=description, epilog=epilogue,
                                      formatter_class=argparse.RawDescriptionHelpFormatter)
     parser.add_argument('filename', help='treemesh.vtk')
     parser.add_argument('-o', action='store_false',
                         help='Output using the original code.')
+    parser.add_argument('--vtkm', action='store_true',
+                        help='Clip with vtkmClip instead of vtkClipDataSet, if VTK was built with VTK-m.')
     args = parser.parse_args()
-    return args.filename, args.o
+    return args.filename, args.o, args.vtkm
 
 
 def main():
-    filename, correct_output = get_program_parameters()
+    filename, correct_output, use_vtkm = get_program_parameters()
+
+    # noinspection PyUnresolvedReferences
+    import vtkmodules.vtkInteractionStyle
+    # noinspection PyUnresolvedReferences
+    import vtkmodules.vtkRenderingOpenGL2
+    from vtkmodules.vtkRenderingCore import (
+        vtkActor,
+        vtkPolyDataMapper,
+        vtkRenderWindow,
+        vtkRenderWindowInteractor,
+        vtkRenderer
+    )
+
+    colors = vtkNamedColors()
 
     # Create the reader for the data.
     reader = vtkUnstructuredGridReader()
     reader.SetFileName(filename)
     reader.Update()
 
-    bounds = reader.GetOutput().GetBounds()
-    center = reader.GetOutput().GetCenter()
+    ug = reader.GetOutput()
+    bounds = ug.GetBounds()
+    center = ug.GetCenter()
 
-    colors = vtkNamedColors()
     renderer = vtkRenderer()
     renderer.SetBackground(colors.GetColor3d('Wheat'))
     renderer.UseHiddenLineRemovalOn()
+    renderer.UseFXAAOn()
 
     renderWindow = vtkRenderWindow()
     renderWindow.AddRenderer(renderer)
@@ -68,78 +85,53 @@ def main():
     xnorm = [-1.0, -1.0, 1.0]
 
     clipPlane = vtkPlane()
-    clipPlane.SetOrigin(reader.GetOutput().GetCenter())
+    clipPlane.SetOrigin(center)
     clipPlane.SetNormal(xnorm)
 
+    # Only the cells that straddle the plane are passed to the clipper.
+    inside = clip_with_plane(ug, clipPlane, use_vtkm=use_vtkm)
     if correct_output:
-        clipper = vtkClipDataSet()
-        clipper.SetClipFunction(clipPlane)
-        clipper.SetInputData(reader.GetOutput())
-        clipper.SetValue(0.0)
-        clipper.GenerateClippedOutputOff()
-        clipper.Update()
-
-        # Set inside out, generate the clipped output and
-        #  use the clipped output for the clipped mapper.
+        # Setting inside out on a second clipper, generating the clipped output and
+        #  using the clipped output for the clipped mapper gives this same half again.
         # If this is done a similar image to
         # ClipUnstructuredGridWithPlane is created.
-        clipper1 = vtkClipDataSet()
-        clipper1.SetClipFunction(clipPlane)
-        clipper1.SetInputData(reader.GetOutput())
-        clipper1.SetValue(0.0)
-        clipper1.InsideOutOn()
-        clipper1.GenerateClippedOutputOn()
-        clipper1.Update()
-
+        clipped = inside
     else:
-        clipper = vtkClipDataSet()
-        clipper.SetClipFunction(clipPlane)
-        clipper.SetInputData(reader.GetOutput())
-        clipper.SetValue(0.0)
-        clipper.GenerateClippedOutputOn()
-        clipper.Update()
-
-        clipper1 = None
+        clipped = clip_with_plane(ug, clipPlane, inside_out=True, use_vtkm=use_vtkm)
 
-    insideMapper = vtkDataSetMapper()
-    insideMapper.SetInputData(clipper.GetOutput())
+    # Extract the surfaces once, the clip outputs do not change
+    #  so the mappers can skip the pipeline checks on each render.
+    insideMapper = vtkPolyDataMapper()
+    insideMapper.SetInputData(extract_surface(inside))
     insideMapper.ScalarVisibilityOff()
+    insideMapper.StaticOn()
 
     insideActor = vtkActor()
     insideActor.SetMapper(insideMapper)
     insideActor.GetProperty().SetDiffuseColor(colors.GetColor3d('Banana'))
     insideActor.GetProperty().SetAmbient(0.3)
-    insideActor.GetProperty().EdgeVisibilityOn()
+    # Drawing the edges is an extra pass per cell, only do it for smaller meshes.
+    insideActor.GetProperty().SetEdgeVisibility(inside.GetNumberOfCells() < MAX_EDGE_CELLS)
 
-    clippedMapper = vtkDataSetMapper()
-    if correct_output:
-        clippedMapper.SetInputData(clipper1.GetClippedOutput())
-    else:
-        clippedMapper.SetInputData(clipper.GetClippedOutput())
+    clippedMapper = vtkPolyDataMapper()
+    clippedMapper.SetInputData(extract_surface(clipped))
     clippedMapper.ScalarVisibilityOff()
+    clippedMapper.StaticOn()
 
     clippedActor = vtkActor()
     clippedActor.SetMapper(clippedMapper)
     clippedActor.GetProperty().SetDiffuseColor(colors.GetColor3d('tomato'))
-    insideActor.GetProperty().SetAmbient(0.3)
-    clippedActor.GetProperty().EdgeVisibilityOn()
+    clippedActor.GetProperty().SetAmbient(0.3)
+    clippedActor.GetProperty().SetEdgeVisibility(clipped.GetNumberOfCells() < MAX_EDGE_CELLS)
 
     # Create transforms to make a better visualization
-    insideTransform = vtkTransform()
-    insideTransform.Translate(-(bounds[1] - bounds[0]) * 0.75, 0, 0)
-    insideTransform.Translate(center[0], center[1], center[2])
-    insideTransform.RotateY(-120.0)
-    insideTransform.Translate(-center[0], -center[1], -center[2])
+    insideTransform = make_transform(-(bounds[1] - bounds[0]) * 0.75, -120.0, center)
     insideActor.SetUserTransform(insideTransform)
 
-    clippedTransform = vtkTransform()
-    clippedTransform.Translate((bounds[1] - bounds[0]) * 0.75, 0, 0)
-    clippedTransform.Translate(center[0], center[1], center[2])
     if correct_output:
-        clippedTransform.RotateY(60.0)
+        clippedTransform = make_transform((bounds[1] - bounds[0]) * 0.75, 60.0, center)
     else:
-        clippedTransform.RotateY(-120.0)
-    clippedTransform.Translate(-center[0], -center[1], -center[2])
+        clippedTransform = make_transform((bounds[1] - bounds[0]) * 0.75, -120.0, center)
     clippedActor.SetUserTransform(clippedTransform)
 
     renderer.AddViewProp(clippedActor)
@@ -155,39 +147,124 @@ def main():
     interactor.Start()
 
     # Generate a report
-    numberOfCells = clipper.GetOutput().GetNumberOfCells()
+    numberOfCells = inside.GetNumberOfCells()
     print('------------------------')
-    print('The inside dataset contains a \n', clipper.GetOutput().GetClassName(), ' that has ', numberOfCells, ' cells')
-    cellMap = dict()
-    for i in range(0, numberOfCells):
-        cellMap.setdefault(clipper.GetOutput().GetCellType(i), 0)
-        cellMap[clipper.GetOutput().GetCellType(i)] += 1
-    # Sort by key and put into an OrderedDict.
-    # An OrderedDict remembers the order in which the keys have been inserted.
-    for k, v in collections.OrderedDict(sorted(cellMap.items())).items():
+    print('The inside dataset contains a \n', inside.GetClassName(), ' that has ', numberOfCells, ' cells')
+    cellMap = cell_type_histogram(inside)
+    for k, v in sorted(cellMap.items()):
         print('\tCell type ', vtkCellTypes.GetClassNameFromTypeId(k), ' occurs ', v, ' times.')
 
     print('------------------------')
-    outsideCellMap = dict()
-    if correct_output:
-        number_of_cells = clipper1.GetClippedOutput().GetNumberOfCells()
-        print('The clipped dataset contains a \n', clipper1.GetClippedOutput().GetClassName(), ' that has ',
-              numberOfCells,
-              ' cells')
-        for i in range(0, number_of_cells):
-            outsideCellMap.setdefault(clipper1.GetClippedOutput().GetCellType(i), 0)
-            outsideCellMap[clipper1.GetClippedOutput().GetCellType(i)] += 1
-    else:
-        number_of_cells = clipper.GetClippedOutput().GetNumberOfCells()
-        print('The clipped dataset contains a \n', clipper.GetClippedOutput().GetClassName(), ' that has ',
-              numberOfCells,
-              ' cells')
-        for i in range(0, number_of_cells):
-            outsideCellMap.setdefault(clipper.GetClippedOutput().GetCellType(i), 0)
-            outsideCellMap[clipper.GetClippedOutput().GetCellType(i)] += 1
-    for k, v in collections.OrderedDict(sorted(outsideCellMap.items())).items():
+    print('The clipped dataset contains a \n', clipped.GetClassName(), ' that has ', clipped.GetNumberOfCells(),
+          ' cells')
+    outsideCellMap = cell_type_histogram(clipped)
+    for k, v in sorted(outsideCellMap.items()):
         print(f' Cell type {vtkCellTypes.GetClassNameFromTypeId(k)} occurs {v} times.')
 
 
+def clip_with_plane(ug, plane, inside_out=False, use_vtkm=False):
+    """
+    Clip an unstructured grid with a plane.
+
+    The cells wholly on the kept side of the plane are extracted with vtkExtractGeometry
+    and passed through unchanged, only the cells straddling the plane are clipped.
+
+    :param ug: The unstructured grid.
+    :param plane: The clip plane.
+    :param inside_out: If True keep the negative side of the plane.
+    :param use_vtkm: If True clip with the data-parallel vtkmClip, if VTK was built with VTK-m.
+    :return: The clipped unstructured grid.
+    """
+    ClipFilter = vtkClipDataSet
+    if use_vtkm:
+        try:
+            from vtkmodules.vtkAcceleratorsVTKmFilters import vtkmClip as ClipFilter
+        except ImportError:
+            print('VTK was not built with VTK-m, using vtkClipDataSet.')
+
+    # The cells with all their points on the kept side.
+    whole = vtkExtractGeometry()
+    whole.SetInputData(ug)
+    whole.SetImplicitFunction(plane)
+    whole.SetExtractInside(inside_out)
+    whole.ExtractBoundaryCellsOff()
+
+    # The cells with only some of their points on the kept side.
+    boundary = vtkExtractGeometry()
+    boundary.SetInputData(ug)
+    boundary.SetImplicitFunction(plane)
+    boundary.SetExtractInside(inside_out)
+    boundary.ExtractBoundaryCellsOn()
+    boundary.ExtractOnlyBoundaryCellsOn()
+
+    clipper = ClipFilter()
+    clipper.SetInputConnection(boundary.GetOutputPort())
+    clipper.SetClipFunction(plane)
+    clipper.SetValue(0.0)
+    clipper.SetInsideOut(inside_out)
+
+    append = vtkAppendFilter()
+    append.AddInputConnection(whole.GetOutputPort())
+    append.AddInputConnection(clipper.GetOutputPort())
+    append.Update()
+    return append.GetOutput()
+
+
+def extract_surface(ug):
+    """
+    Extract the surface of an unstructured grid.
+
+    :param ug: The unstructured grid.
+    :return: The surface as poly data.
+    """
+    geometry_filter = vtkGeometryFilter()
+    geometry_filter.SetInputData(ug)
+    geometry_filter.Update()
+    return geometry_filter.GetOutput()
+
+
+def make_transform(tx, ry_deg, center):
+    """
+    Make a transform that rotates about the y-axis through the center and then translates along x.
+
+    The matrix is composed in NumPy and set in one call, it is equivalent to
+    Translate(tx, 0, 0), Translate(center), RotateY(ry_deg), Translate(-center).
+
+    :param tx: The translation along the x-axis.
+    :param ry_deg: The rotation about the y-axis in degrees.
+    :param center: The center of rotation.
+    :return: The transform.
+    """
+    t1 = np.eye(4)
+    t1[0, 3] = tx
+    t2 = np.eye(4)
+    t2[:3, 3] = center
+    t3 = np.eye(4)
+    t3[:3, 3] = np.negative(center)
+    c, s = np.cos(np.radians(ry_deg)), np.sin(np.radians(ry_deg))
+    r = np.array([[c, 0.0, s, 0.0],
+                  [0.0, 1.0, 0.0, 0.0],
+                  [-s, 0.0, c, 0.0],
+                  [0.0, 0.0, 0.0, 1.0]])
+    m = vtkMatrix4x4()
+    m.DeepCopy((t1 @ t2 @ r @ t3).ravel().tolist())
+    transform = vtkTransform()
+    transform.SetMatrix(m)
+    return transform
+
+
+def cell_type_histogram(ds):
+    """
+    Count the cells of each type in an unstructured grid.
+
+    :param ds: The unstructured grid.
+    :return: A dict of cell type: number of cells.
+    """
+    if ds.GetNumberOfCells() == 0:
+        return dict()
+    keys, counts = np.unique(vtk_to_numpy(ds.GetCellTypes()), return_counts=True)
+    return dict(zip(keys.tolist(), counts.tolist()))
+
+
 if __name__ == '__main__':
     main()
@@ -1,11 +1,16 @@
 #!/usr/bin/env python3
 
-# noinspection PyUnresolvedReferences
-import vtkmodules.vtkRenderingOpenGL2
+import numpy as np
+from vtkmodules.util.numpy_support import (
+    numpy_to_vtk,
+    vtk_to_numpy
+)
 from vtkmodules.vtkCommonColor import vtkNamedColors
-from vtkmodules.vtkFiltersCore import vtkElevationFilter
+from vtkmodules.vtkCommonCore import (
+    VTK_UNSIGNED_CHAR,
+    vtkLookupTable
+)
 from vtkmodules.vtkFiltersSources import vtkConeSource, vtkSphereSource
-from vtkmodules.vtkInteractionStyle import vtkInteractorStyleTrackballCamera
 from vtkmodules.vtkRenderingCore import (
     vtkActor,
     vtkDiscretizableColorTransferFunction,
@@ -15,11 +20,17 @@ from vtkmodules.vtkRenderingCore import (
     vtkRenderer
 )
 
+# The OpenGL and interaction modules are imported where they are used.
+
 
 def main():
     colors = vtkNamedColors()
     colors.SetColor('ParaViewBkg', 82, 87, 110, 255)
 
+    # noinspection PyUnresolvedReferences
+    import vtkmodules.vtkRenderingOpenGL2
+    from vtkmodules.vtkInteractionStyle import vtkInteractorStyleTrackballCamera
+
     ren = vtkRenderer()
     ren.SetBackground(colors.GetColor3d('ParaViewBkg'))
     ren_win = vtkRenderWindow()
@@ -43,17 +54,34 @@ def main():
     cone.Update()
     bounds = cone.GetOutput().GetBounds()
 
-    elevation_filter = vtkElevationFilter()
-    elevation_filter.SetLowPoint(0, bounds[2], 0)
-    elevation_filter.SetHighPoint(0, bounds[3], 0)
-    elevation_filter.SetInputConnection(cone.GetOutputPort())
-    # elevation_filter.SetInputConnection(sphere.GetOutputPort())
-
-    ctf = get_ctf()
+    poly_data = cone.GetOutput()
+    # sphere.Update()
+    # poly_data = sphere.GetOutput()
+
+    # The elevation is the y coordinate scaled to [0, 1] over the height of the cone.
+    y = vtk_to_numpy(poly_data.GetPoints().GetData())[:, 1]
+    elevation = numpy_to_vtk(np.clip((y - bounds[2]) / (bounds[3] - bounds[2]), 0.0, 1.0), deep=True)
+    elevation.SetName('Elevation')
+    poly_data.GetPointData().SetScalars(elevation)
+    scalar_range = elevation.GetRange()
+
+    # Sample the transfer function once into an opaque lookup table,
+    #  the mapper then does a table look up per scalar.
+    table_size = 256
+    rgb = np.empty((table_size, 3), dtype=np.float64)
+    get_ctf().GetTable(0.0, 1.0, table_size, rgb.ravel())
+    rgba = np.full((table_size, 4), 255, dtype=np.uint8)
+    rgba[:, :3] = (rgb * 255.0 + 0.5).astype(np.uint8)
+    lut = vtkLookupTable()
+    lut.SetNumberOfTableValues(table_size)
+    lut.SetTable(numpy_to_vtk(rgba, deep=True, array_type=VTK_UNSIGNED_CHAR))
 
     mapper = vtkPolyDataMapper()
-    mapper.SetInputConnection(elevation_filter.GetOutputPort())
-    mapper.SetLookupTable(ctf)
+    mapper.SetInputData(poly_data)
+    mapper.SetLookupTable(lut)
+    mapper.SetScalarRange(scalar_range)
+    # The elevations do not change, so skip the pipeline checks on each render.
+    mapper.StaticOn()
     mapper.SetColorModeToMapScalars()
     mapper.InterpolateScalarsBeforeMappingOn()
 
@@ -1,25 +1,36 @@
 #!/usr/bin/env python3
 
+import json
 import sys
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from operator import itemgetter
 from pathlib import Path
+from stat import S_ISREG
 
-# noinspection PyUnresolvedReferences
-import vtkmodules.vtkRenderingOpenGL2
-from lxml import etree
-from vtkmodules.vtkCommonColor import vtkNamedColors
-from vtkmodules.vtkFiltersCore import vtkElevationFilter
-from vtkmodules.vtkFiltersSources import vtkConeSource, vtkSphereSource
-from vtkmodules.vtkInteractionStyle import vtkInteractorStyleTrackballCamera
-from vtkmodules.vtkRenderingCore import (
-    vtkActor,
-    vtkPolyDataMapper,
-    vtkRenderWindow,
-    vtkRenderWindowInteractor,
-    vtkRenderer
-)
-from vtkmodules.vtkRenderingCore import (
-    vtkDiscretizableColorTransferFunction,
-)
+import numpy as np
+
+# lxml and the VTK modules are imported where they are used,
+#  so that --help does not load them and generating the code does not load the rendering modules.
+
+# Get the (r, g, b) attributes of an element in one call.
+_RGB = itemgetter('r', 'g', 'b')
+
+# The only elements that are read, the rest are skipped by libxml2.
+_TAGS = ('ColorMap', 'Point', 'NaN', 'Above', 'Below')
+
+# The methods setting the interpolation space and scale, the defaults are RGB and linear.
+_COLOR_SPACE_SETTERS = {
+    'hsv': 'SetColorSpaceToHSV',
+    'lab': 'SetColorSpaceToLab',
+    'cielab': 'SetColorSpaceToLab',
+    'ciede2000': 'SetColorSpaceToLabCIEDE2000',
+    'diverging': 'SetColorSpaceToDiverging',
+    'step': 'SetColorSpaceToStep',
+}
+_SCALE_SETTERS = {
+    'log10': 'SetScaleToLog10',
+}
 
 
 def get_program_parameters(argv):
@@ -27,58 +38,64 @@ def get_program_parameters(argv):
     description = 'Take an XML description of a colormap and convert it to a VTK colormap.'
     epilogue = '''
     A color transfer function in C++ or Python can be optionally generated.
+    Several XML files can be given along with -g, the code for each is generated in turn.
     '''
     parser = argparse.ArgumentParser(description=description, epilog=epilogue,
                                      formatter_class=argparse.RawDescriptionHelpFormatter)
 
-    parser.add_argument('file_name', help='The path to the XML file e.g Fast.xml.')
+    parser.add_argument('file_name', nargs='+', help='The path to the XML file e.g Fast.xml.')
     parser.add_argument('-d', action='store_true', dest='discretize', help='Discretize the colormap.')
     parser.add_argument('-s', dest='size', default=None, type=int,
                         help='Specify the size of the colormap.')
+    # The language names and aliases, any case is accepted.
+    languages = {'cxx': 'Cxx', 'cpp': 'Cxx', 'c++': 'Cxx', 'python': 'Python', 'py': 'Python'}
     parser.add_argument('-g', dest='generate_function', default=None,
+                        type=lambda lang: languages.get(lang.lower(), lang), choices=['Cxx', 'Python'],
                         help='Generate code for the color transfer function,'
-                             ' specify the desired language one of: Cxx, Python.')
+                             ' specify the desired language one of: Cxx, Python.'
+                             ' The colormap is not displayed.')
+    parser.add_argument('-c', action='store_true', dest='use_cache',
+                        help='Keep the parsed colormap in a .npz file next to the XML file,'
+                             ' and read that instead while the XML file is unchanged.')
 
     args = parser.parse_args()
-    return args.file_name, args.discretize, args.size, args.generate_function
+    if len(args.file_name) > 1 and args.generate_function is None:
+        parser.error('Several XML files can only be given with -g.')
+    return args.file_name, args.discretize, args.size, args.generate_function, args.use_cache
 
 
-def main(file_name, discretize, table_size, generate_function):
-    if file_name:
-        fn_path = Path(file_name)
-        if not fn_path.suffix:
-            fn_path = fn_path.with_suffix(".xml")
-        if not fn_path.is_file():
-            print('Unable to find: ', fn_path)
-            return
-    else:
-        print('Please enter a path to the XML file.')
+def main(file_name, discretize, table_size, generate_function, use_cache=False):
+    fn_path = get_xml_path(file_name)
+    if fn_path is None:
         return
-    parameters = parse_xml(fn_path)
-
-    if generate_function is not None:
-        generate_function = generate_function.lower()
-        available_languages = {k.lower(): k for k in ['Cxx', 'Python']}
-        available_languages.update({'cpp': 'Cxx', 'c++': 'Cxx', 'py': 'Python'})
-        if generate_function not in available_languages:
-            print(f'The language: {generate_function} is not available.')
-            tmp = ', '.join(sorted([lang for lang in set(available_languages.values())]))
-            print(f'Choose one of these: {tmp}.')
-            return
-        else:
-            language = available_languages[generate_function]
-    else:
-        language = None
+    parameters = parse_xml(fn_path, use_cache)
 
     # There is just one entry in the parameters dict.
-    colormap_name = list(parameters.keys())[0]
+    colormap_name = next(iter(parameters))
     ctf = make_ctf(parameters[colormap_name], discretize, table_size)
 
-    if language is not None and language in ['Cxx', 'Python']:
-        if language == 'Python':
-            generate_ctf_python(parameters[colormap_name], discretize, table_size)
-        else:
-            generate_ctf_cpp(parameters[colormap_name], discretize, table_size)
+    # The language has been checked by get_program_parameters().
+    if generate_function == 'Python':
+        generate_ctf_python(parameters[colormap_name], discretize, table_size)
+    elif generate_function == 'Cxx':
+        generate_ctf_cpp(parameters[colormap_name], discretize, table_size)
+    if generate_function is not None:
+        # Only the code is wanted, so do not display the colormap.
+        return
+
+    # noinspection PyUnresolvedReferences
+    import vtkmodules.vtkRenderingOpenGL2
+    from vtkmodules.vtkCommonColor import vtkNamedColors
+    from vtkmodules.vtkFiltersCore import vtkElevationFilter
+    from vtkmodules.vtkFiltersSources import vtkConeSource, vtkSphereSource
+    from vtkmodules.vtkInteractionStyle import vtkInteractorStyleTrackballCamera
+    from vtkmodules.vtkRenderingCore import (
+        vtkActor,
+        vtkPolyDataMapper,
+        vtkRenderWindow,
+        vtkRenderWindowInteractor,
+        vtkRenderer
+    )
 
     colors = vtkNamedColors()
     colors.SetColor('ParaViewBkg', 82, 87, 110, 255)
@@ -131,65 +148,128 @@ def main(file_name, discretize, table_size, generate_function):
     iren.Start()
 
 
-def parse_xml(fn_path):
+def batch_main(file_names, discretize, table_size, generate_function, use_cache=False):
+    """
+    Generate the code for the color transfer functions of several colormaps.
+
+    The files are parsed in a thread pool, the code is written in the order of the files.
+    :param file_names: The paths to the XML files.
+    :param discretize: True if the values are to be mapped after discretization.
+    :param table_size: The table size.
+    :param generate_function: The language, one of: Cxx, Python.
+    :param use_cache: True if the parsed colormaps are to be kept in, and read from, .npz files.
+    """
+    fn_paths = [get_xml_path(file_name) for file_name in file_names]
+    if None in fn_paths:
+        return
+    generate = generate_ctf_python if generate_function == 'Python' else generate_ctf_cpp
+
+    with ThreadPoolExecutor() as executor:
+        # The results come back in the order of the files, each is written as soon as it is ready.
+        for parameters in executor.map(lambda fn_path: parse_xml(fn_path, use_cache), fn_paths):
+            generate(next(iter(parameters.values())), discretize, table_size)
+
+
+def get_xml_path(file_name):
+    """
+    Get the path to an XML file, .xml is added if there is no suffix.
+
+    :param file_name: The file name.
+    :return: The path or None if the file cannot be found.
+    """
+    if not file_name:
+        print('Please enter a path to the XML file.')
+        return None
+    fn_path = Path(file_name)
+    if not fn_path.suffix:
+        fn_path = fn_path.with_suffix(".xml")
+    # A single stat() tells if the file exists and is a regular file.
+    try:
+        is_file = S_ISREG(fn_path.stat().st_mode)
+    except OSError:
+        is_file = False
+    if not is_file:
+        print('Unable to find: ', fn_path)
+        return None
+    return fn_path
+
+
+def parse_xml(fn_path, use_cache=False):
     """
     Parse the XML file of a colormap.
 
     Check out: https://sciviscolor.org/colormaps/ for some good XML files.
+    The file is read in one streaming pass, each element is freed as soon as it has been read.
     :param fn_path: The path to the XML file.
+    :param use_cache: True if the parsed colormap is to be kept in, and read from, a .npz file next to the XML file.
     :return: The parameters for the color map.
     """
-    with open(fn_path) as data_file:
-        xml_doc = etree.parse(data_file)
-
-    def extract(d):
-        """
-        Pull out the data we need.
-
-        :param d: The parsed XML data.
-        :return: The extracted data.
-        """
-        color_map_details = dict()
-        data_values = list()
-        color_values = list()
-        opacity_values = list()
-        nan = None
-        above = None
-        below = None
-        if d is not None:
-            color_map_details = dict(d.attrib)
-            if 'space' in color_map_details:
-                # Some XML files use space instead of interpolation space.
-                if color_map_details['space'].lower() not in ['rgb', 'hsv']:
-                    color_map_details['interpolationspace'] = color_map_details['space']
-                    # Assume RGB
-                    color_map_details['space'] = 'RGB'
-        for pt in d.findall('.//Point'):
+    if use_cache:
+        cache_path = fn_path.with_name(f'{fn_path.name}.npz')
+        # The cache is used only if it was made from this version of the XML file.
+        stat = fn_path.stat()
+        key = [stat.st_mtime_ns, stat.st_size]
+        res = load_cache(cache_path, key, fn_path)
+        if res is not None:
+            return res
+
+    from lxml import etree
+
+    color_map_details = None
+    data_values = list()
+    color_values = list()
+    opacity_values = list()
+    nan = None
+    above = None
+    below = None
+    add_data_value = data_values.append
+    add_color_value = color_values.append
+    add_opacity_value = opacity_values.append
+    # libxml2 reads the file itself, there is no decoding or buffering in Python.
+    for _, elem in etree.iterparse(str(fn_path), events=('end',), tag=_TAGS):
+        tag = elem.tag
+        if tag == 'Point':
             # "o" is opacity it (along with "cms" and "isMoT") are ignored.
             # "x" is the scalar value associated with the color (specified by "r", "g", and "b").
-            data_values.append(pt.attrib['x'])
-            color_values.append((pt.attrib['r'], pt.attrib['g'], pt.attrib['b']))
-            if pt.attrib['o']:
-                opacity_values.append(pt.attrib['o'])
-        val = d.find('.//NaN')
-        if val is not None:
-            nan = (val.attrib['r'], val.attrib['g'], val.attrib['b'])
-        val = d.find('.//Above')
-        if val is not None:
-            above = (val.attrib['r'], val.attrib['g'], val.attrib['b'])
-        val = d.find('.//Below')
-        if val is not None:
-            below = (val.attrib['r'], val.attrib['g'], val.attrib['b'])
-        return {'color_map_details': color_map_details, 'data_values': data_values,
-                'color_values': color_values, 'opacity_values': opacity_values, 'NaN': nan, 'Above': above,
-                'Below': below}
-
-    s = xml_doc.getroot().find('ColorMap')
-    if s is None:
+            attrib = elem.attrib
+            add_data_value(attrib['x'])
+            add_color_value(_RGB(attrib))
+            # Not all files have an opacity.
+            opacity = attrib.get('o')
+            if opacity:
+                add_opacity_value(opacity)
+        elif tag == 'NaN':
+            nan = _RGB(elem.attrib)
+        elif tag == 'Above':
+            above = _RGB(elem.attrib)
+        elif tag == 'Below':
+            below = _RGB(elem.attrib)
+        else:
+            # Only the first colormap is used.
+            color_map_details = dict(elem.attrib)
+            break
+        # Free the element and any already processed siblings.
+        elem.clear()
+        while elem.getprevious() is not None:
+            del elem.getparent()[0]
+
+    if color_map_details is None:
         sys.exit('The attribute "ColorMap" is not found.')
+    if 'space' in color_map_details:
+        # Some XML files use space instead of interpolation space.
+        if color_map_details['space'].lower() not in ['rgb', 'hsv']:
+            color_map_details['interpolationspace'] = color_map_details['space']
+            # Assume RGB
+            color_map_details['space'] = 'RGB'
+
+    # The points as numbers, the strings are kept for the code generation.
+    xs = np.array(data_values, dtype=np.float64)
+    rgb = np.array(color_values, dtype=np.float64).reshape(-1, 3)
+
     res = dict()
-    parameters = extract(s)
-    parameters['path'] = fn_path.name
+    parameters = {'color_map_details': color_map_details, 'data_values': data_values,
+                  'color_values': color_values, 'xs': xs, 'rgb': rgb, 'opacity_values': opacity_values,
+                  'NaN': nan, 'Above': above, 'Below': below, 'path': fn_path.name}
     cm_name = parameters['color_map_details']['name']
     # Do some checks.
     if cm_name is not None:
@@ -199,9 +279,93 @@ def parse_xml(fn_path):
             if len(parameters['opacity_values']) != len(parameters['color_values']):
                 sys.exit(f'{parameters["path"]}: The opacity values length must be the same as colors.')
         res[cm_name] = parameters
+        if use_cache:
+            save_cache(cache_path, key, parameters)
     return res
 
 
+def load_cache(cache_path, key, fn_path):
+    """
+    Load the parameters of a colormap saved by save_cache().
+
+    :param cache_path: The path to the .npz file.
+    :param key: The modification time and size of the XML file.
+    :param fn_path: The path to the XML file.
+    :return: The parameters for the color map or None if there is no usable cache.
+    """
+    try:
+        with np.load(cache_path) as cache:
+            if cache['key'].tolist() != key:
+                return None
+            meta = json.loads(cache['meta'].item())
+            parameters = {'color_map_details': meta['color_map_details'],
+                          'data_values': cache['data_values'].tolist(),
+                          'color_values': cache['color_values'].tolist(), 'xs': cache['xs'], 'rgb': cache['rgb'],
+                          'opacity_values': cache['opacity_values'].tolist(),
+                          'NaN': meta['NaN'], 'Above': meta['Above'], 'Below': meta['Below'], 'path': fn_path.name}
+    except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+        return None
+    return {parameters['color_map_details']['name']: parameters}
+
+
+def save_cache(cache_path, key, parameters):
+    """
+    Save the parameters of a colormap, the values are kept as the strings in the XML file along with the arrays.
+
+    :param cache_path: The path to the .npz file.
+    :param key: The modification time and size of the XML file.
+    :param parameters: The parameters for the color map.
+    """
+    meta = {k: parameters[k] for k in ('color_map_details', 'NaN', 'Above', 'Below')}
+    tmp_path = cache_path.with_name(f'{cache_path.name}.tmp')
+    try:
+        # Write to a temporary file first, so that an interrupted write never leaves a partial cache.
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, key=key, meta=json.dumps(meta), xs=parameters['xs'], rgb=parameters['rgb'],
+                     data_values=np.array(parameters['data_values'], dtype=str),
+                     color_values=np.array(parameters['color_values'], dtype=str).reshape(-1, 3),
+                     opacity_values=np.array(parameters['opacity_values'], dtype=str))
+        tmp_path.replace(cache_path)
+    except OSError:
+        # The cache is just an optimization, e.g. the directory may be read only.
+        pass
+
+
+def color_space_setter(parameters):
+    """
+    Get the name of the method that sets the interpolation space.
+
+    :param parameters: The parameters.
+    :return: The method name.
+    """
+    interp_space = parameters['color_map_details'].get('interpolationspace') or ''
+    return _COLOR_SPACE_SETTERS.get(interp_space.lower(), 'SetColorSpaceToRGB')
+
+
+def scale_setter(parameters):
+    """
+    Get the name of the method that sets the scale.
+
+    :param parameters: The parameters.
+    :return: The method name.
+    """
+    scale = parameters['color_map_details'].get('interpolationtype') or ''
+    return _SCALE_SETTERS.get(scale.lower(), 'SetScaleToLinear')
+
+
+def evenly_spaced(xs):
+    """
+    Check if the points are where BuildFunctionFromTable() would put them.
+
+    :param xs: The x values of the points.
+    :return: True if the points are evenly spaced from the first to the last.
+    """
+    if xs.size < 2 or xs[-1] <= xs[0]:
+        return False
+    step = (xs[-1] - xs[0]) / (xs.size - 1)
+    return np.array_equal(xs, xs[0] + np.arange(xs.size) * step)
+
+
 def make_ctf(parameters, discretize, table_size=None):
     """
     Generate the discretizable color transfer function
@@ -210,38 +374,12 @@ def make_ctf(parameters, discretize, table_size=None):
     :param table_size: The table size.
     :return: The discretizable color transfer function.
     """
+    from vtkmodules.vtkRenderingCore import vtkDiscretizableColorTransferFunction
 
     ctf = vtkDiscretizableColorTransferFunction()
 
-    interp_space = parameters['color_map_details'].get('interpolationspace', None)
-    if interp_space:
-        interp_space = interp_space.lower()
-        if interp_space == 'hsv':
-            ctf.SetColorSpaceToHSV()
-        elif interp_space == 'lab':
-            ctf.SetColorSpaceToLab()
-        elif interp_space == 'cielab':
-            ctf.SetColorSpaceToLab()
-        elif interp_space == 'ciede2000':
-            ctf.SetColorSpaceToLabCIEDE2000()
-        elif interp_space == 'diverging':
-            ctf.SetColorSpaceToDiverging()
-        elif interp_space == 'step':
-            ctf.SetColorSpaceToStep()
-        else:
-            ctf.SetColorSpaceToRGB()
-    else:
-        ctf.SetColorSpaceToRGB()
-
-    scale = parameters['color_map_details'].get('interpolationtype', None)
-    if scale:
-        scale = scale.lower()
-        if scale == 'log10':
-            ctf.SetScaleToLog10()
-        else:
-            ctf.SetScaleToLinear()
-    else:
-        ctf.SetScaleToLinear()
+    getattr(ctf, color_space_setter(parameters))()
+    getattr(ctf, scale_setter(parameters))()
 
     if parameters['NaN'] is not None:
         color = list(map(float, parameters['NaN']))
@@ -259,14 +397,18 @@ def make_ctf(parameters, discretize, table_size=None):
 
     space = parameters['color_map_details'].get('space', None)
     if space:
-        space = space.lower()
-        for i in range(0, len(parameters['data_values'])):
-            color = list(map(float, parameters['color_values'][i]))
-            idx = float(parameters['data_values'][i])
-            if space == 'hsv':
-                ctf.AddHSVPoint(idx, *color)
-            else:
-                ctf.AddRGBPoint(idx, *color)
+        xs = parameters['xs']
+        rgb = parameters['rgb']
+        if space.lower() == 'hsv':
+            # There is no bulk method for HSV points.
+            for x, (h, s, v) in zip(xs.tolist(), rgb.tolist()):
+                ctf.AddHSVPoint(x, h, s, v)
+        elif evenly_spaced(xs):
+            # The points are set from the table in one pass, with no sorting after each point.
+            ctf.BuildFunctionFromTable(xs[0], xs[-1], xs.size, rgb.ravel())
+        else:
+            # Add all the (x, r, g, b) points in one call.
+            ctf.FillFromDataPointer(xs.size, np.column_stack((xs, rgb)).ravel())
 
     if table_size is not None:
         ctf.SetNumberOfValues(table_size)
@@ -305,81 +447,52 @@ def generate_ctf_python(parameters, discretize, table_size=None):
         comment += f' space: {parameters["color_map_details"]["space"]}'
     comment += f'\n{indent}# file name: {parameters["path"]}\n'
 
-    s = ['', f'def get_ctf():', comment, f'{indent}ctf = vtkDiscretizableColorTransferFunction()', '']
-
-    interp_space = parameters['color_map_details'].get('interpolationspace', None)
-    if interp_space:
-        interp_space = interp_space.lower()
-        if interp_space == 'hsv':
-            s.append(f'{indent}ctf.SetColorSpaceToHSV()')
-        elif interp_space == 'lab':
-            s.append(f'{indent}ctf.SetColorSpaceToLab()')
-        elif interp_space == 'cielab':
-            s.append(f'{indent}ctf.SetColorSpaceToLab()')
-        elif interp_space == 'ciede2000':
-            s.append(f'{indent}ctf.SetColorSpaceToLabCIEDE2000()')
-        elif interp_space == 'diverging':
-            s.append(f'{indent}ctf.SetColorSpaceToDiverging()')
-        elif interp_space == 'step':
-            s.append(f'{indent}ctf.SetColorSpaceToStep()')
-        else:
-            s.append(f'{indent}ctf.SetColorSpaceToRGB()')
-    else:
-        s.append(f'{indent}ctf.SetColorSpaceToRGB()')
+    # The lines are written to stdout as they are made.
+    out = sys.stdout
+    w = out.write
 
-    scale = parameters['color_map_details'].get('interpolationtype', None)
-    if scale:
-        scale = scale.lower()
-        if scale == 'log10':
-            s.append(f'{indent}ctf.SetScaleToLog10()')
-        else:
-            s.append(f'{indent}ctf.SetScaleToLinear()')
-    else:
-        s.append(f'{indent}ctf.SetScaleToLinear()')
-    s.append('')
+    w(f'\ndef get_ctf():\n{comment}\n{indent}ctf = vtkDiscretizableColorTransferFunction()\n\n')
+
+    w(f'{indent}ctf.{color_space_setter(parameters)}()\n')
+    w(f'{indent}ctf.{scale_setter(parameters)}()\n\n')
 
     if parameters['NaN'] is not None:
         color = ', '.join(parameters['NaN'])
-        s.append(f'{indent}ctf.SetNanColor({color})')
+        w(f'{indent}ctf.SetNanColor({color})\n')
 
     if parameters['Above'] is not None:
         color = ', '.join(parameters['Above'])
-        s.append(f'{indent}ctf.SetAboveRangeColor({color})')
-        s.append(f'{indent}ctf.UseAboveRangeColorOn()')
+        w(f'{indent}ctf.SetAboveRangeColor({color})\n')
+        w(f'{indent}ctf.UseAboveRangeColorOn()\n')
 
     if parameters['Below'] is not None:
         color = ', '.join(parameters['Below'])
-        s.append(f'{indent}ctf.SetBelowRangeColor({color})')
-        s.append(f'{indent}ctf.UseBelowRangeColorOn()')
-    s.append('')
+        w(f'{indent}ctf.SetBelowRangeColor({color})\n')
+        w(f'{indent}ctf.UseBelowRangeColorOn()\n')
+    w('\n')
 
     space = parameters['color_map_details'].get('space', None)
     if space:
-        space = space.lower()
-        for i in range(0, len(parameters['data_values'])):
-            color = ', '.join(parameters['color_values'][i])
-            idx = parameters['data_values'][i]
-            if space == 'hsv':
-                s.append(f'{indent}ctf.AddHSVPoint({idx}, {color})')
-            else:
-                s.append(f'{indent}ctf.AddRGBPoint({idx}, {color})')
-        s.append('')
+        add_point = 'AddHSVPoint' if space.lower() == 'hsv' else 'AddRGBPoint'
+        # All the points are written in one call, the start of the line is the same for each point.
+        head = f'{indent}ctf.{add_point}('
+        w(''.join([f'{head}{x}, {r}, {g}, {b})\n'
+                   for x, (r, g, b) in zip(parameters['data_values'], parameters['color_values'])]))
+        w('\n')
 
     if table_size is not None:
-        s.append(f'{indent}ctf.SetNumberOfValues({table_size})')
+        w(f'{indent}ctf.SetNumberOfValues({table_size})\n')
     else:
-        s.append(f'{indent}ctf.SetNumberOfValues({len(parameters["data_values"])})')
+        w(f'{indent}ctf.SetNumberOfValues({len(parameters["data_values"])})\n')
 
     if discretize:
-        s.append(f'{indent}ctf.DiscretizeOn()')
+        w(f'{indent}ctf.DiscretizeOn()\n\n')
     else:
-        s.append(f'{indent}ctf.DiscretizeOff()')
-    s.append('')
+        w(f'{indent}ctf.DiscretizeOff()\n\n')
 
-    s.append(f'{indent}return ctf')
-    s.append('')
+    w(f'{indent}return ctf\n\n')
 
-    print('\n'.join(s))
+    out.flush()
 
 
 def generate_ctf_cpp(parameters, discretize, table_size=None):
@@ -406,85 +519,58 @@ def generate_ctf_cpp(parameters, discretize, table_size=None):
         comment += f' space: {parameters["color_map_details"]["space"]}'
     comment += f'\n{indent}// file name: {parameters["path"]}\n'
 
-    s = ['', f'vtkNew<vtkDiscretizableColorTransferFunction> GetCTF()', '{', comment,
-         f'{indent}vtkNew<vtkDiscretizableColorTransferFunction> ctf;', '']
-
-    interp_space = parameters['color_map_details'].get('interpolationspace', None)
-    if interp_space:
-        interp_space = interp_space.lower()
-        if interp_space == 'hsv':
-            s.append(f'{indent}ctf->SetColorSpaceToHSV();')
-        elif interp_space == 'lab':
-            s.append(f'{indent}ctf->SetColorSpaceToLab();')
-        elif interp_space == 'cielab':
-            s.append(f'{indent}ctf->SetColorSpaceToLab();')
-        elif interp_space == 'ciede2000':
-            s.append(f'{indent}ctf->SetColorSpaceToLabCIEDE2000();')
-        elif interp_space == 'diverging':
-            s.append(f'{indent}ctf->SetColorSpaceToDiverging();')
-        elif interp_space == 'step':
-            s.append(f'{indent}ctf->SetColorSpaceToStep();')
-        else:
-            s.append(f'{indent}ctf->SetColorSpaceToRGB();')
-    else:
-        s.append(f'{indent}ctf->SetColorSpaceToRGB();')
+    # The lines are written to stdout as they are made.
+    out = sys.stdout
+    w = out.write
 
-    scale = parameters['color_map_details'].get('interpolationtype', None)
-    if scale:
-        scale = scale.lower()
-        if scale == 'log10':
-            s.append(f'{indent}ctf->SetScaleToLog10();')
-        else:
-            s.append(f'{indent}ctf->SetScaleToLinear();')
-    else:
-        s.append(f'{indent}ctf->SetScaleToLinear();')
-    s.append('')
+    w(f'\nvtkNew<vtkDiscretizableColorTransferFunction> GetCTF()\n{{\n{comment}\n'
+      f'{indent}vtkNew<vtkDiscretizableColorTransferFunction> ctf;\n\n')
+
+    w(f'{indent}ctf->{color_space_setter(parameters)}();\n')
+    w(f'{indent}ctf->{scale_setter(parameters)}();\n\n')
 
     if parameters['NaN'] is not None:
         color = ', '.join(parameters['NaN'])
-        s.append(f'{indent}ctf->SetNanColor({color});')
+        w(f'{indent}ctf->SetNanColor({color});\n')
 
     if parameters['Above'] is not None:
         color = ', '.join(parameters['Above'])
-        s.append(f'{indent}ctf->SetAboveRangeColor({color});')
-        s.append(f'{indent}ctf->UseAboveRangeColorOn();')
+        w(f'{indent}ctf->SetAboveRangeColor({color});\n')
+        w(f'{indent}ctf->UseAboveRangeColorOn();\n')
 
     if parameters['Below'] is not None:
         color = ', '.join(parameters['Below'])
-        s.append(f'{indent}ctf->SetBelowRangeColor({color});')
-        s.append(f'{indent}ctf->UseBelowRangeColorOn();')
-    s.append('')
+        w(f'{indent}ctf->SetBelowRangeColor({color});\n')
+        w(f'{indent}ctf->UseBelowRangeColorOn();\n')
+    w('\n')
 
     space = parameters['color_map_details'].get('space', None)
     if space:
-        space = space.lower()
-        for i in range(0, len(parameters['data_values'])):
-            color = ', '.join(parameters['color_values'][i])
-            idx = parameters['data_values'][i]
-            if space == 'hsv':
-                s.append(f'{indent}ctf->AddHSVPoint({idx}, {color});')
-            else:
-                s.append(f'{indent}ctf->AddRGBPoint({idx}, {color});')
-        s.append('')
+        add_point = 'AddHSVPoint' if space.lower() == 'hsv' else 'AddRGBPoint'
+        # All the points are written in one call, the start of the line is the same for each point.
+        head = f'{indent}ctf->{add_point}('
+        w(''.join([f'{head}{x}, {r}, {g}, {b});\n'
+                   for x, (r, g, b) in zip(parameters['data_values'], parameters['color_values'])]))
+        w('\n')
 
     if table_size is not None:
-        s.append(f'{indent}ctf->SetNumberOfValues({table_size});')
+        w(f'{indent}ctf->SetNumberOfValues({table_size});\n')
     else:
-        s.append(f'{indent}ctf->SetNumberOfValues({len(parameters["data_values"])});')
+        w(f'{indent}ctf->SetNumberOfValues({len(parameters["data_values"])});\n')
 
     if discretize:
-        s.append(f'{indent}ctf->DiscretizeOn();')
+        w(f'{indent}ctf->DiscretizeOn();\n\n')
     else:
-        s.append(f'{indent}ctf->DiscretizeOff();')
-    s.append('')
+        w(f'{indent}ctf->DiscretizeOff();\n\n')
 
-    s.append(f'{indent}return ctf;')
-    s.append('}')
-    s.append('')
+    w(f'{indent}return ctf;\n}}\n\n')
 
-    print('\n'.join(s))
+    out.flush()
 
 
 if __name__ == '__main__':
-    file, discretise, size, generate = get_program_parameters(sys.argv)
-    main(file, discretise, size, generate)
+    files, discretise, size, generate, cache = get_program_parameters(sys.argv)
+    if len(files) == 1:
+        main(files[0], discretise, size, generate, cache)
+    else:
+        batch_main(files, discretise, size, generate, cache)
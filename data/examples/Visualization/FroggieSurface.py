@@ -1,34 +1,61 @@
 #!/usr/bin/env python3
 
-import copy
+import functools
 import json
+import os
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
+import numpy as np
+
 # noinspection PyUnresolvedReferences
 import vtkmodules.vtkInteractionStyle
 # noinspection PyUnresolvedReferences
 import vtkmodules.vtkRenderingOpenGL2
+from vtkmodules.util.numpy_support import (
+    numpy_to_vtk,
+    vtk_to_numpy
+)
 from vtkmodules.vtkCommonColor import vtkNamedColors
-from vtkmodules.vtkCommonCore import vtkLookupTable
+from vtkmodules.vtkCommonCore import (
+    VTK_CHAR,
+    VTK_UNSIGNED_CHAR,
+    vtkCharArray,
+    vtkLookupTable,
+    vtkSMPTools
+)
+from vtkmodules.vtkCommonDataModel import (
+    vtkDataObject,
+    vtkPolyData
+)
+from vtkmodules.vtkCommonExecutionModel import (
+    vtkThreadedImageAlgorithm,
+    vtkTrivialProducer
+)
 from vtkmodules.vtkCommonMath import vtkMatrix4x4
 from vtkmodules.vtkCommonTransforms import vtkTransform
 from vtkmodules.vtkFiltersCore import (
-    vtkDecimatePro,
+    vtkAppendPolyData,
     vtkFlyingEdges3D,
     vtkMarchingCubes,
     vtkPolyDataNormals,
-    vtkStripper,
+    vtkQuadricDecimation,
+    vtkReverseSense,
+    vtkThreshold,
     vtkWindowedSincPolyDataFilter
 )
-from vtkmodules.vtkFiltersGeneral import vtkTransformPolyDataFilter
+from vtkmodules.vtkFiltersGeneral import vtkDiscreteFlyingEdges3D
+from vtkmodules.vtkFiltersGeometry import vtkGeometryFilter
 from vtkmodules.vtkIOImage import vtkMetaImageReader
 from vtkmodules.vtkImagingCore import (
+    vtkExtractVOI,
     vtkImageShrink3D,
     vtkImageThreshold
 )
 from vtkmodules.vtkImagingGeneral import vtkImageGaussianSmooth
 from vtkmodules.vtkImagingMorphological import vtkImageIslandRemoval2D
 from vtkmodules.vtkInteractionStyle import vtkInteractorStyleTrackballCamera
+from vtkmodules.vtkParallelCore import vtkCommunicator
 from vtkmodules.vtkInteractionWidgets import (
     vtkCameraOrientationWidget,
     vtkOrientationMarkerWidget
@@ -78,14 +105,19 @@ Note:
     parser.add_argument('file_name', help='The path to the JSON file e.g. Frog_mhd.json.')
     parser.add_argument('-t', nargs='+', dest='tissues', action='append', help='Select one or more tissues.')
     parser.add_argument('-m', action='store_false', dest='flying_edges',
-                        help='Use flying edges by default, marching cubes if set.')
+                        help='Use flying edges by default, the legacy serial marching cubes if set.')
     # -o: obliterate a synonym for decimation.
-    parser.add_argument('-o', action='store_true', dest='decimation', help='Decimate if set.')
+    parser.add_argument('-o', action='store_true', dest='decimation', help='Decimate, this is the default.')
+    parser.add_argument('--no-decimate', action='store_false', dest='decimation', help='Do not decimate.')
+    parser.set_defaults(decimation=True)
+    parser.add_argument('--discrete', action='store_true',
+                        help='Extract the tissues from the label volume in one pass of discrete flying edges,'
+                             ' the volume is not shrunk or smoothed.')
     args = parser.parse_args()
-    return args.file_name, args.view, args.tissues, args.flying_edges, args.decimation
+    return args.file_name, args.view, args.tissues, args.flying_edges, args.decimation, args.discrete
 
 
-def main(fn, select_figure, chosen_tissues, flying_edges, decimate):
+def main(fn, select_figure, chosen_tissues, flying_edges, decimate, discrete):
     if not select_figure:
         select_figure = 'p'
 
@@ -140,6 +172,9 @@ def main(fn, select_figure, chosen_tissues, flying_edges, decimate):
             parameters['skin']['opacity'] = 1.0
         tissues = res
 
+    backend, threads = initialize_smp()
+    print(f'SMP backend: {backend} using {threads} threads.')
+
     colors = vtkNamedColors()
     colors.SetColor("ParaViewBkg", [82, 87, 110, 255])
 
@@ -160,13 +195,41 @@ def main(fn, select_figure, chosen_tissues, flying_edges, decimate):
            f'{"Tissue":<{name_size}s}{" Label "}{"Color"}',
            line]
 
-    so = SliceOrder()
+    workers = min(len(tissues), os.cpu_count() or 1)
+    if workers > 1 and not discrete:
+        # The tissues are independent, so make their surfaces in a pool of processes,
+        #  sharing out the threads between them. The rendering stays in this process.
+        with ProcessPoolExecutor(max_workers=workers, initializer=initialize_smp,
+                                 initargs=(max(1, threads // workers),)) as executor:
+            futures = [executor.submit(make_tissue_surface, name, parameters[name], parameters['mhd_files'],
+                                       flying_edges, decimate) for name in tissues]
+            surfaces = [unmarshal_surface(future.result()) for future in futures]
+    else:
+        surfaces = create_tissue_surfaces(tissues, parameters, flying_edges, decimate, discrete)
 
-    for name in tissues:
-        actor = create_tissue_actor(name, parameters[name], parameters['mhd_files'], flying_edges, decimate,
-                                    color_lut, so)
-        ren.AddActor(actor)
+    # The surfaces are in the coordinates of the volumes, the actors orient them using the
+    #  transform for the slice order so that the points are not transformed on the CPU.
+    so = SliceOrder()
+    # The opaque tissues with the same slice order are drawn by one actor colored by the tissue labels,
+    #  the translucent tissues each need an actor of their own for the opacity.
+    opaque_surfaces = dict()
+    for name, surface in zip(tissues, surfaces):
+        if surface is None:
+            print(f'Tissue: {name} is not in the volume.')
+            continue
+        transform = so.get(parameters[name]['slice_order'])
+        surface = get_front_facing_surface(surface, parameters[name]['slice_order'])
+        if parameters[name]['opacity'] == 1.0:
+            opaque_surfaces.setdefault(parameters[name]['slice_order'], list()).append(
+                get_labelled_surface(surface, parameters[name]['tissue']))
+        else:
+            ren.AddActor(create_tissue_actor(parameters[name], surface, color_lut, transform))
         res.append(f'{name:<{name_size}s} {indices[name]:{int_size + 3}d} {parameters["colors"][name]:<{color_size}s}')
+    for order, order_surfaces in opaque_surfaces.items():
+        ren.AddActor(create_opaque_tissues_actor(order_surfaces, color_lut, so.get(order)))
+    # The actors hold their own copies of the surfaces, so the pipelines
+    #  and the volumes they were made from are freed now.
+    del surfaces, opaque_surfaces
 
     res.append(line)
     print('\n'.join(res))
@@ -254,6 +317,25 @@ def main(fn, select_figure, chosen_tissues, flying_edges, decimate):
     iren.Start()
 
 
+def initialize_smp(threads=0):
+    """
+    Make sure that the filters using vtkSMPTools run multithreaded.
+
+    VTK builds default to the sequential backend unless they were built with TBB or OpenMP,
+     so use the C++ threads backend then. A backend set with VTK_SMP_BACKEND_IN_USE is kept.
+    The threaded image filters, e.g. the shrinker and the Gaussian smoother, are switched
+     from vtkMultiThreader to vtkSMPTools so that they share the same thread pool.
+
+    :param threads: The maximum number of threads, 0 for the default.
+    :return: The backend and the number of threads.
+    """
+    if vtkSMPTools.GetBackend() == 'Sequential' and 'VTK_SMP_BACKEND_IN_USE' not in os.environ:
+        vtkSMPTools.SetBackend('STDThread')
+    vtkSMPTools.Initialize(threads)
+    vtkThreadedImageAlgorithm.SetGlobalDefaultEnableSMP(True)
+    return vtkSMPTools.GetBackend(), vtkSMPTools.GetEstimatedNumberOfThreads()
+
+
 def parse_json(fn_path):
     """
     Parse the JSON file selecting the components that we want.
@@ -287,9 +369,8 @@ def parse_json(fn_path):
                                 print(f'Expected two file names.')
                                 paths_ok = False
                             # The stem of the file path becomes the key.
-                            path_map = dict()
-                            for p in list(map(lambda pp: root / pp, v[kk])):
-                                path_map[p.stem] = p
+                            path_map = {p.stem: p for p in (root / pp for pp in v[kk])}
+                            for p in path_map.values():
                                 if not p.is_file():
                                     paths_ok = False
                                     print(f'Not a file {p}')
@@ -305,18 +386,16 @@ def parse_json(fn_path):
             if k == "tissue_parameters":
                 # Assemble the parameters for each tissue.
                 # Create the base parameters.
-                bp = dict()
-                for kk, vv in v['default'].items():
-                    bp[kk.lower()] = vv
-                frog = copy.deepcopy(bp)
-                for kk, vv in v['frog'].items():
-                    frog[kk.lower()] = vv
+                # The parameter values are all scalars, so shallow copies are enough.
+                bp = {kk.lower(): vv for kk, vv in v['default'].items()}
+                frog = bp.copy()
+                frog.update({kk.lower(): vv for kk, vv in v['frog'].items()})
                 for kk, vv in v.items():
                     if kk not in ['default', 'frog', 'parameter types']:
                         if kk == 'skin':
-                            parameters[kk] = copy.deepcopy(bp)
+                            parameters[kk] = bp.copy()
                         else:
-                            parameters[kk] = copy.deepcopy(frog)
+                            parameters[kk] = frog.copy()
                         for kkk, vvv in vv.items():
                             parameters[kk][kkk.lower()] = vvv
                             if kkk == 'NAME':
@@ -324,53 +403,125 @@ def parse_json(fn_path):
     return paths_ok, parameters
 
 
-def create_tissue_actor(name, tissue, files, flying_edges, decimate, lut, so):
+def create_tissue_surfaces(tissues, parameters, flying_edges, decimate, discrete):
     """
-    Create the actor for a specific tissue.
+    Create the pipelines generating the surfaces of the tissues in this process.
+
+    :param tissues: The tissue names.
+    :param parameters: The parameters.
+    :param flying_edges: If true use flying edges.
+    :param decimate: If true decimate.
+    :param discrete: If true select the tissues from one pass of discrete flying edges.
+    :return: The last filter in the pipeline for each tissue, None if the tissue is not in the volume.
+    """
+    # One reader for each volume, shared by all the tissues extracted from it.
+    # The reader executes once, for the first tissue, and the other tissue pipelines use its output.
+    readers = dict()
+    for stem, path in parameters['mhd_files'].items():
+        reader = vtkMetaImageReader()
+        reader.SetFileName(str(path))
+        readers[stem] = reader
+
+    labels = None
+    found = set()
+    selected = [parameters[name]['tissue'] for name in tissues if name != 'skin']
+    if discrete and selected:
+        # One pass over the label volume extracts the surfaces of all the selected tissues.
+        labels, found = create_discrete_surfaces(readers['frogtissue'], selected)
+
+    surfaces = list()
+    for name in tissues:
+        if labels is not None and name != 'skin' and parameters[name]['tissue'] not in found:
+            surfaces.append(None)
+        else:
+            surfaces.append(create_tissue_surface(name, parameters[name], readers, flying_edges, decimate, labels))
+    return surfaces
+
+
+def create_tissue_surface(name, tissue, readers, flying_edges, decimate, labels=None):
+    """
+    Create the pipeline generating the surface of a specific tissue.
 
     :param name: The tissue name.
     :param tissue: The tissue parameters.
-    :param files: The path to the tissue files.
+    :param readers: The readers for the volumes, keyed by the file stem.
     :param flying_edges: If true use flying edges.
     :param decimate: If true decimate.
-    :param lut: The color lookup table for the tissues.
-    :param so: The transforms corresponding to the slice order.
-    :return: The actor.
+    :param labels: If given, the discrete flying edges surfaces of all the tissue labels,
+     the tissue surface is selected from these instead of being extracted from the volume.
+    :return: The last filter in the pipeline, None if the tissue is not in the volume.
     """
 
-    pixel_size = tissue['pixel_size']
-    spacing = tissue['spacing']
-    start_slice = tissue['start_slice']
-    data_spacing = [pixel_size, pixel_size, spacing]
-    columns = tissue['columns']
-    rows = tissue['rows']
-    data_origin = [-(columns / 2.0) * pixel_size, -(rows / 2.0) * pixel_size, start_slice * spacing]
-
-    voi = [
-        tissue['start_column'],
-        tissue['end_column'],
-        tissue['start_row'],
-        tissue['end_row'],
-        tissue['start_slice'],
-        tissue['end_slice'],
-    ]
-    # Adjust y bounds for PNM coordinate system.
-    tmp = voi[2]
-    voi[2] = rows - voi[3] - 1
-    voi[3] = rows - tmp - 1
+    # The decimator removes points and the smoother moves them, after either of them the normals
+    #  are recomputed, otherwise those computed by the iso-surface filter are used.
+    decimated = decimate and tissue['decimate_reduction'] > 0
+    smoothed = tissue['smooth_iterations'] != 0
+    if labels is not None and name != 'skin':
+        iso_surface = select_tissue_label(labels, tissue['tissue'])
+        has_normals = False
+    else:
+        has_normals = not (decimated or smoothed)
+        iso_surface = create_tissue_iso_surface(name, tissue, readers, flying_edges, has_normals)
+        if iso_surface is None:
+            return None
+
+    # The surface is left in the coordinates of the volume, the actor applies the slice order transform.
+    last_connection = iso_surface
+
+    # Decimate before smoothing, so that the later filters and the mapper work on the reduced mesh.
+    # Quadric decimation keeps the shape better than vtkDecimatePro at high reductions.
+    if decimated:
+        decimator = vtkQuadricDecimation()
+        decimator.SetInputConnection(last_connection.GetOutputPort())
+        decimator.SetTargetReduction(tissue['decimate_reduction'])
+        decimator.VolumePreservationOn()
+        last_connection = decimator
 
+    if smoothed:
+        smoother = vtkWindowedSincPolyDataFilter()
+        smoother.SetInputConnection(last_connection.GetOutputPort())
+        smoother.SetNumberOfIterations(tissue['smooth_iterations'])
+        smoother.BoundarySmoothingOff()
+        smoother.FeatureEdgeSmoothingOff()
+        smoother.SetFeatureAngle(tissue['smooth_angle'])
+        smoother.SetPassBand(tissue['smooth_factor'])
+        smoother.NonManifoldSmoothingOn()
+        smoother.NormalizeCoordinatesOff()
+        last_connection = smoother
+
+    if not has_normals:
+        normals = vtkPolyDataNormals()
+        normals.SetInputConnection(last_connection.GetOutputPort())
+        normals.SetFeatureAngle(tissue['feature_angle'])
+        last_connection = normals
+
+    # The triangles are drawn as they are, stripping them is a serial pass
+    #  over the mesh that does not make them render faster on current GPUs.
+    return last_connection
+
+
+def create_tissue_iso_surface(name, tissue, readers, flying_edges, compute_normals):
+    """
+    Create the pipeline extracting the iso-surface of a specific tissue from the volume.
+
+    :param name: The tissue name.
+    :param tissue: The tissue parameters.
+    :param readers: The readers for the volumes, keyed by the file stem.
+    :param flying_edges: If true use flying edges.
+    :param compute_normals: If true compute the normals while extracting the iso-surface.
+    :return: The iso-surface filter, None if the tissue is not in the volume.
+    """
+
+    # The spacing, origin and extent of the volumes come from the .mhd headers.
     if name == 'skin':
-        fn = files['frog']
+        reader = readers['frog']
     else:
-        fn = files['frogtissue']
-
-    reader = vtkMetaImageReader()
-    reader.SetFileName(str(fn))
-    reader.SetDataSpacing(data_spacing)
-    reader.SetDataOrigin(data_origin)
-    reader.SetDataExtent(voi)
-    reader.Update()
+        reader = readers['frogtissue']
 
+    # The filters are connected by their ports, only the tissue mask is updated here
+    #  and the rest of the pipeline is executed when the surface is updated.
+    # The reader is shared by the tissues, the volumes made by the other filters
+    #  are only used by the next filter so they are released once it has executed.
     last_connection = reader
 
     if not name == 'skin':
@@ -379,15 +530,19 @@ def create_tissue_actor(name, tissue, files, flying_edges, decimate, lut, so):
             island_remover.SetAreaThreshold(tissue['island_area'])
             island_remover.SetIslandValue(tissue['island_replace'])
             island_remover.SetReplaceValue(tissue['tissue'])
-            island_remover.SetInput(last_connection.GetOutput())
-            island_remover.Update()
+            island_remover.SetInputConnection(last_connection.GetOutputPort())
+            island_remover.ReleaseDataFlagOn()
             last_connection = island_remover
 
         select_tissue = vtkImageThreshold()
         select_tissue.ThresholdBetween(tissue['tissue'], tissue['tissue'])
         select_tissue.SetInValue(255)
         select_tissue.SetOutValue(0)
+        # The mask only holds 0 and 255, so the shrinker, smoother and iso-surface
+        #  can work on unsigned chars whatever the type of the volume.
+        select_tissue.SetOutputScalarTypeToUnsignedChar()
         select_tissue.SetInputConnection(last_connection.GetOutputPort())
+        select_tissue.ReleaseDataFlagOn()
         last_connection = select_tissue
 
     sample_rate = [
@@ -396,218 +551,347 @@ def create_tissue_actor(name, tissue, files, flying_edges, decimate, lut, so):
         tissue['sample_rate_slice'],
     ]
 
-    shrinker = vtkImageShrink3D()
-    shrinker.SetInputConnection(last_connection.GetOutputPort())
-    shrinker.SetShrinkFactors(sample_rate)
-    shrinker.AveragingOn()
-    last_connection = shrinker
-
     gsd = [
         tissue['gaussian_standard_deviation_column'],
         tissue['gaussian_standard_deviation_row'],
         tissue['gaussian_standard_deviation_slice'],
     ]
+    grf = [
+        tissue['gaussian_radius_factor_column'],
+        tissue['gaussian_radius_factor_row'],
+        tissue['gaussian_radius_factor_slice'],
+    ]
 
-    if not all(v == 0 for v in gsd):
-        grf = [
-            tissue['gaussian_radius_factor_column'],
-            tissue['gaussian_radius_factor_row'],
-            tissue['gaussian_radius_factor_slice'],
-        ]
+    if not name == 'skin':
+        # Most tissues only fill a small part of the volume, so crop the mask to the box
+        #  around the tissue before shrinking, smoothing and extracting the surface.
+        # The crop follows the threshold, vtkMetaImageReader always reads the whole volume
+        #  and fails if a filter downstream asks it for a smaller extent.
+        select_tissue.Update()
+        voi = get_tissue_voi(select_tissue.GetOutput(), sample_rate, [int(s * r) for s, r in zip(gsd, grf)])
+        if voi is None:
+            return None
+        extract_voi = vtkExtractVOI()
+        extract_voi.SetInputConnection(last_connection.GetOutputPort())
+        extract_voi.SetVOI(voi)
+        extract_voi.ReleaseDataFlagOn()
+        # Crop now, so that only the cropped mask is kept until the surface is made.
+        extract_voi.Update()
+        last_connection = extract_voi
+
+    # Shrinking by one along every axis only copies the volume.
+    if any(v != 1 for v in sample_rate):
+        shrinker = vtkImageShrink3D()
+        shrinker.SetInputConnection(last_connection.GetOutputPort())
+        shrinker.SetShrinkFactors(sample_rate)
+        shrinker.AveragingOn()
+        shrinker.ReleaseDataFlagOn()
+        last_connection = shrinker
 
+    if not all(v == 0 for v in gsd):
         gaussian = vtkImageGaussianSmooth()
         gaussian.SetStandardDeviation(*gsd)
         gaussian.SetRadiusFactors(*grf)
-        gaussian.SetInputConnection(shrinker.GetOutputPort())
+        gaussian.SetInputConnection(last_connection.GetOutputPort())
+        gaussian.ReleaseDataFlagOn()
         last_connection = gaussian
 
     iso_value = tissue['value']
     if flying_edges:
+        # The passes of flying edges are run in parallel by vtkSMPTools.
         iso_surface = vtkFlyingEdges3D()
-        iso_surface.SetInputConnection(last_connection.GetOutputPort())
-        iso_surface.ComputeScalarsOff()
-        iso_surface.ComputeGradientsOff()
-        iso_surface.ComputeNormalsOff()
-        iso_surface.SetValue(0, iso_value)
-        iso_surface.Update()
+        iso_surface.InterpolateAttributesOff()
     else:
         iso_surface = vtkMarchingCubes()
-        iso_surface.SetInputConnection(last_connection.GetOutputPort())
-        iso_surface.ComputeScalarsOff()
-        iso_surface.ComputeGradientsOff()
-        iso_surface.ComputeNormalsOff()
-        iso_surface.SetValue(0, iso_value)
-        iso_surface.Update()
-
-    transform = so.get(tissue['slice_order'])
-    tf = vtkTransformPolyDataFilter()
-    tf.SetTransform(transform)
-    tf.SetInputConnection(iso_surface.GetOutputPort())
-    last_connection = tf
-
-    if decimate:
-        decimator = vtkDecimatePro()
-        decimator.SetInputConnection(last_connection.GetOutputPort())
-        decimator.SetFeatureAngle(tissue['decimate_angle'])
-        decimator.PreserveTopologyOn()
-        decimator.SetErrorIsAbsolute(1)
-        decimator.SetAbsoluteError(tissue['decimate_error'])
-        decimator.SetTargetReduction(tissue['decimate_reduction'])
-        last_connection = decimator
+    iso_surface.SetInputConnection(last_connection.GetOutputPort())
+    iso_surface.ComputeScalarsOff()
+    iso_surface.ComputeGradientsOff()
+    iso_surface.SetComputeNormals(compute_normals)
+    iso_surface.SetValue(0, iso_value)
 
-    smooth_iterations = tissue['smooth_iterations']
-    if smooth_iterations != 0:
-        smoother = vtkWindowedSincPolyDataFilter()
-        smoother.SetInputConnection(last_connection.GetOutputPort())
-        smoother.BoundarySmoothingOff()
-        smoother.FeatureEdgeSmoothingOff()
-        smoother.SetFeatureAngle(tissue['smooth_angle'])
-        smoother.SetPassBand(tissue['smooth_factor'])
-        smoother.NonManifoldSmoothingOn()
-        smoother.NormalizeCoordinatesOff()
-        last_connection = smoother
+    return iso_surface
 
-    normals = vtkPolyDataNormals()
-    normals.SetInputConnection(last_connection.GetOutputPort())
-    normals.SetFeatureAngle(tissue['feature_angle'])
 
-    stripper = vtkStripper()
-    stripper.SetInputConnection(normals.GetOutputPort())
+def create_discrete_surfaces(reader, labels):
+    """
+    Extract the surfaces of all the tissue labels in one pass over the volume.
+
+    The label volume is neither shrunk nor smoothed, only the later
+     smoothing of the surfaces is applied.
+
+    :param reader: The reader for the tissue volume.
+    :param labels: The tissue labels.
+    :return: The surfaces and the labels that are in the volume.
+    """
+    discrete = vtkDiscreteFlyingEdges3D()
+    discrete.SetInputConnection(reader.GetOutputPort())
+    for i, label in enumerate(labels):
+        discrete.SetValue(i, label)
+    discrete.ComputeGradientsOff()
+    discrete.ComputeNormalsOff()
+    # The point scalars are the labels, they are used to select the surface of each tissue.
+    discrete.ComputeScalarsOn()
+    discrete.Update()
+    found = set(np.unique(vtk_to_numpy(discrete.GetOutput().GetPointData().GetScalars())).tolist())
+    return discrete, found
+
+
+def select_tissue_label(labels, label):
+    """
+    Select the surface of one tissue from the discrete flying edges surfaces.
 
+    :param labels: The surfaces of all the tissue labels.
+    :param label: The tissue label.
+    :return: The filter producing the tissue surface.
+    """
+    threshold = vtkThreshold()
+    threshold.SetInputConnection(labels.GetOutputPort())
+    threshold.SetInputArrayToProcess(0, 0, 0, vtkDataObject.FIELD_ASSOCIATION_POINTS,
+                                     labels.GetOutput().GetPointData().GetScalars().GetName())
+    threshold.SetThresholdFunction(vtkThreshold.THRESHOLD_BETWEEN)
+    threshold.SetLowerThreshold(label)
+    threshold.SetUpperThreshold(label)
+
+    geometry = vtkGeometryFilter()
+    geometry.SetInputConnection(threshold.GetOutputPort())
+    return geometry
+
+
+def get_tissue_voi(mask, sample_rate, radius):
+    """
+    Get the extent of the box around the nonzero voxels of a tissue mask.
+
+    The box is padded by twice the smoothing kernel radius, so the smoothed voxels near the
+     tissue and the zero boundary of the iso-surface are as in the whole volume.
+    Its lower corner is aligned to the shrink factors, so the shrunk voxels are the same too.
+
+    :param mask: The tissue mask.
+    :param sample_rate: The shrink factors.
+    :param radius: The smoothing kernel radius, in shrunk voxels.
+    :return: The extent of the box, None if the mask is empty.
+    """
+    extent = mask.GetExtent()
+    dims = [extent[2 * i + 1] - extent[2 * i] + 1 for i in range(3)]
+    voxels = vtk_to_numpy(mask.GetPointData().GetScalars()).reshape(dims[::-1]) != 0
+    voi = list()
+    # The mask is indexed [slice, row, column].
+    for i, axes in enumerate(((0, 1), (0, 2), (1, 2))):
+        idx = np.flatnonzero(voxels.any(axis=axes))
+        if idx.size == 0:
+            return None
+        pad = (2 * radius[i] + 1) * sample_rate[i]
+        lo = (idx[0] - pad) // sample_rate[i] * sample_rate[i] + extent[2 * i]
+        hi = idx[-1] + pad + extent[2 * i]
+        voi += [max(lo, extent[2 * i]), min(hi, extent[2 * i + 1])]
+    return voi
+
+
+def create_tissue_actor(tissue, surface, lut, transform):
+    """
+    Create the actor for a specific tissue.
+
+    :param tissue: The tissue parameters.
+    :param surface: The algorithm producing the surface of the tissue.
+    :param lut: The color lookup table for the tissues.
+    :param transform: The transform for the slice order of the tissue.
+    :return: The actor.
+    """
+    # The surface does not change once it is made, so make it now and let the mapper
+    #  skip the pipeline checks on each render.
+    # The mapper takes a copy of the surface, not the pipeline, so the pipeline can be freed.
+    surface.Update()
+    poly_data = vtkPolyData()
+    poly_data.ShallowCopy(surface.GetOutputDataObject(0))
     mapper = vtkPolyDataMapper()
-    mapper.SetInputConnection(stripper.GetOutputPort())
+    mapper.SetInputData(poly_data)
+    mapper.StaticOn()
 
     actor = vtkActor()
     actor.SetMapper(mapper)
+    actor.SetUserTransform(transform)
     actor.GetProperty().SetOpacity(tissue['opacity'])
     actor.GetProperty().SetDiffuseColor(lut.GetTableValue(tissue['tissue'])[:3])
     actor.GetProperty().SetSpecular(0.5)
     actor.GetProperty().SetSpecularPower(10)
+    # The opaque surfaces are closed, so their back faces are never seen.
+    actor.GetProperty().SetBackfaceCulling(tissue['opacity'] == 1.0)
 
     return actor
 
 
-class SliceOrder:
+def get_front_facing_surface(surface, order):
     """
-    These transformations permute image and other geometric data to maintain proper
-     orientation regardless of the acquisition order. After applying these transforms with
-    vtkTransformFilter, a view up of 0, -1, 0 will result in the body part
-    facing the viewer.
-    NOTE: some transformations have a -1 scale factor for one of the components.
-          To ensure proper polygon orientation and normal direction, you must
-          apply the vtkPolyDataNormals filter.
+    Reverse the polygons of a surface whose slice order is a reflection.
 
-    Naming (the nomenclature is medical):
-    si - superior to inferior (top to bottom)
-    is - inferior to superior (bottom to top)
-    ap - anterior to posterior (front to back)
-    pa - posterior to anterior (back to front)
-    lr - left to right
-    rl - right to left
+    A transform with a negative determinant turns the polygons inside out,
+     so they would be culled or lit from behind. The normals are kept as they are,
+     the actor transforms them into the right direction.
+
+    :param surface: The algorithm producing the surface in the coordinates of the volume.
+    :param order: The slice order.
+    :return: The algorithm producing the surface to give to the actor.
     """
+    if np.linalg.det(_SLICE_ORDERS[order]) > 0:
+        return surface
+    reverse = vtkReverseSense()
+    reverse.SetInputConnection(surface.GetOutputPort())
+    reverse.ReverseCellsOn()
+    reverse.ReverseNormalsOff()
+    return reverse
 
-    def __init__(self):
-        self.si_mat = vtkMatrix4x4()
-        self.si_mat.Zero()
-        self.si_mat.SetElement(0, 0, 1)
-        self.si_mat.SetElement(1, 2, 1)
-        self.si_mat.SetElement(2, 1, -1)
-        self.si_mat.SetElement(3, 3, 1)
-
-        self.is_mat = vtkMatrix4x4()
-        self.is_mat.Zero()
-        self.is_mat.SetElement(0, 0, 1)
-        self.is_mat.SetElement(1, 2, -1)
-        self.is_mat.SetElement(2, 1, -1)
-        self.is_mat.SetElement(3, 3, 1)
-
-        self.lr_mat = vtkMatrix4x4()
-        self.lr_mat.Zero()
-        self.lr_mat.SetElement(0, 2, -1)
-        self.lr_mat.SetElement(1, 1, -1)
-        self.lr_mat.SetElement(2, 0, 1)
-        self.lr_mat.SetElement(3, 3, 1)
-
-        self.rl_mat = vtkMatrix4x4()
-        self.rl_mat.Zero()
-        self.rl_mat.SetElement(0, 2, 1)
-        self.rl_mat.SetElement(1, 1, -1)
-        self.rl_mat.SetElement(2, 0, 1)
-        self.rl_mat.SetElement(3, 3, 1)
 
-        """
-        The previous transforms assume radiological views of the slices
-         (viewed from the feet).
-        Other modalities such as physical sectioning may view from the head.
-        The following transforms modify the original with a 180° rotation about y
-        """
+def get_labelled_surface(surface, label):
+    """
+    Get the surface of a specific tissue with the tissue label as the cell scalars.
 
-        self.hf_mat = vtkMatrix4x4()
-        self.hf_mat.Zero()
-        self.hf_mat.SetElement(0, 0, -1)
-        self.hf_mat.SetElement(1, 1, 1)
-        self.hf_mat.SetElement(2, 2, -1)
-        self.hf_mat.SetElement(3, 3, 1)
+    :param surface: The algorithm producing the surface of the tissue.
+    :param label: The tissue label.
+    :return: A copy of the surface.
+    """
+    surface.Update()
+    poly_data = vtkPolyData()
+    poly_data.ShallowCopy(surface.GetOutputDataObject(0))
+    labels = numpy_to_vtk(np.full(poly_data.GetNumberOfCells(), label, dtype=np.uint8), deep=True,
+                          array_type=VTK_UNSIGNED_CHAR)
+    labels.SetName('Tissue')
+    poly_data.GetCellData().SetScalars(labels)
+    return poly_data
 
-        self.transform = dict()
 
-        si_trans = vtkTransform()
-        si_trans.SetMatrix(self.si_mat)
-        self.transform['si'] = si_trans
+def create_opaque_tissues_actor(surfaces, lut, transform):
+    """
+    Create one actor for all the opaque tissues.
+
+    The surfaces are appended into one, so they are drawn together
+     and each tissue is colored by mapping its label through the lookup table.
+
+    :param surfaces: The surfaces of the tissues, with the tissue labels as the cell scalars.
+    :param lut: The color lookup table for the tissues.
+    :param transform: The transform for the slice order of the tissues.
+    :return: The actor.
+    """
+    append = vtkAppendPolyData()
+    for surface in surfaces:
+        append.AddInputData(surface)
+    append.Update()
+    poly_data = vtkPolyData()
+    poly_data.ShallowCopy(append.GetOutput())
+
+    mapper = vtkPolyDataMapper()
+    mapper.SetInputData(poly_data)
+    mapper.SetLookupTable(lut)
+    mapper.UseLookupTableScalarRangeOn()
+    mapper.SetScalarModeToUseCellData()
+    mapper.SetColorModeToMapScalars()
+    mapper.ScalarVisibilityOn()
+    mapper.StaticOn()
+
+    actor = vtkActor()
+    actor.SetMapper(mapper)
+    actor.SetUserTransform(transform)
+    actor.GetProperty().SetSpecular(0.5)
+    actor.GetProperty().SetSpecularPower(10)
+    # The opaque surfaces are closed, so their back faces are never seen.
+    actor.GetProperty().BackfaceCullingOn()
+
+    return actor
 
-        is_trans = vtkTransform()
-        is_trans.SetMatrix(self.is_mat)
-        self.transform['is'] = is_trans
 
-        ap_trans = vtkTransform()
-        ap_trans.Scale(1, -1, 1)
-        self.transform['ap'] = ap_trans
+@functools.lru_cache(maxsize=None)
+def _worker_reader(path):
+    # A worker process reads each volume at most once.
+    reader = vtkMetaImageReader()
+    reader.SetFileName(path)
+    return reader
 
-        pa_trans = vtkTransform()
-        pa_trans.Scale(1, -1, -1)
-        self.transform['pa'] = pa_trans
 
-        lr_trans = vtkTransform()
-        lr_trans.SetMatrix(self.lr_mat)
-        self.transform['lr'] = lr_trans
+def make_tissue_surface(name, tissue, mhd_files, flying_edges, decimate):
+    """
+    Make the surface of a specific tissue, this is run in a worker process.
 
-        rl_trans = vtkTransform()
-        rl_trans.SetMatrix(self.rl_mat)
-        self.transform['rl'] = rl_trans
+    :param name: The tissue name.
+    :param tissue: The tissue parameters.
+    :param mhd_files: The paths to the volumes, keyed by the file stem.
+    :param flying_edges: If true use flying edges.
+    :param decimate: If true decimate.
+    :return: The surface marshalled into bytes, None if the tissue is not in the volume.
+    """
+    readers = {stem: _worker_reader(str(path)) for stem, path in mhd_files.items()}
+    surface = create_tissue_surface(name, tissue, readers, flying_edges, decimate)
+    if surface is None:
+        return None
+    surface.Update()
+    buffer = vtkCharArray()
+    vtkCommunicator.MarshalDataObject(surface.GetOutput(), buffer)
+    return vtk_to_numpy(buffer).tobytes()
 
-        hf_trans = vtkTransform()
-        hf_trans.SetMatrix(self.hf_mat)
-        self.transform['hf'] = hf_trans
 
-        hf_si_trans = vtkTransform()
-        hf_si_trans.SetMatrix(self.hf_mat)
-        hf_si_trans.Concatenate(self.si_mat)
-        self.transform['hfsi'] = hf_si_trans
+def unmarshal_surface(data):
+    """
+    Rebuild a surface made by make_tissue_surface().
 
-        hf_is_trans = vtkTransform()
-        hf_is_trans.SetMatrix(self.hf_mat)
-        hf_is_trans.Concatenate(self.is_mat)
-        self.transform['hfis'] = hf_is_trans
+    :param data: The marshalled surface.
+    :return: A producer for the surface, None if there is no surface.
+    """
+    if data is None:
+        return None
+    surface = vtkPolyData()
+    vtkCommunicator.UnMarshalDataObject(numpy_to_vtk(np.frombuffer(data, dtype=np.int8), array_type=VTK_CHAR),
+                                        surface)
+    producer = vtkTrivialProducer()
+    producer.SetOutput(surface)
+    return producer
 
-        hf_ap_trans = vtkTransform()
-        hf_ap_trans.SetMatrix(self.hf_mat)
-        hf_ap_trans.Scale(1, -1, 1)
-        self.transform['hfap'] = hf_ap_trans
 
-        hf_pa_trans = vtkTransform()
-        hf_pa_trans.SetMatrix(self.hf_mat)
-        hf_pa_trans.Scale(1, -1, -1)
-        self.transform['hfpa'] = hf_pa_trans
+def _slice_orders():
+    """
+    Make the homogenous matrices corresponding to the slice orders, see SliceOrder.
+
+    :return: A dictionary of the matrices keyed by the slice order.
+    """
+    si = np.array([[1, 0, 0, 0], [0, 0, 1, 0], [0, -1, 0, 0], [0, 0, 0, 1]], dtype=np.float64)
+    is_ = np.array([[1, 0, 0, 0], [0, 0, -1, 0], [0, -1, 0, 0], [0, 0, 0, 1]], dtype=np.float64)
+    ap = np.diag([1.0, -1.0, 1.0, 1.0])
+    pa = np.diag([1.0, -1.0, -1.0, 1.0])
+    lr = np.array([[0, 0, -1, 0], [0, -1, 0, 0], [1, 0, 0, 0], [0, 0, 0, 1]], dtype=np.float64)
+    rl = np.array([[0, 0, 1, 0], [0, -1, 0, 0], [1, 0, 0, 0], [0, 0, 0, 1]], dtype=np.float64)
+    # The previous matrices assume radiological views of the slices (viewed from the feet).
+    # Other modalities such as physical sectioning may view from the head.
+    # This matrix modifies the original with a 180° rotation about y.
+    hf = np.diag([-1.0, 1.0, -1.0, 1.0])
+
+    orders = {'si': si, 'is': is_, 'ap': ap, 'pa': pa, 'lr': lr, 'rl': rl}
+    orders.update({f'hf{k}': hf @ v for k, v in orders.items()})
+    orders['hf'] = hf
+    return orders
+
 
-        hf_lr_trans = vtkTransform()
-        hf_lr_trans.SetMatrix(self.hf_mat)
-        hf_lr_trans.Concatenate(self.lr_mat)
-        self.transform['hflr'] = hf_lr_trans
+_SLICE_ORDERS = _slice_orders()
 
-        hf_rl_trans = vtkTransform()
-        hf_rl_trans.SetMatrix(self.hf_mat)
-        hf_rl_trans.Concatenate(self.rl_mat)
-        self.transform['hfrl'] = hf_rl_trans
+
+class SliceOrder:
+    """
+    These transformations permute image and other geometric data to maintain proper
+     orientation regardless of the acquisition order. After setting these transforms on
+    the actors with SetUserTransform(), a view up of 0, -1, 0 will result in the body part
+    facing the viewer.
+    NOTE: some transformations have a -1 scale factor for one of the components.
+          Their determinant is -1, so they turn the polygons inside out. The polygons
+          of these surfaces are reversed with vtkReverseSense, see get_front_facing_surface().
+          The normals are left as they are, the actor transforms them.
+
+    Naming (the nomenclature is medical):
+    si - superior to inferior (top to bottom)
+    is - inferior to superior (bottom to top)
+    ap - anterior to posterior (front to back)
+    pa - posterior to anterior (back to front)
+    lr - left to right
+    rl - right to left
+    """
+
+    def __init__(self):
+        # The transforms are only made for the slice orders that are used.
+        self.transform = dict()
 
     def print_transform(self, order):
         """
@@ -616,7 +900,7 @@ class SliceOrder:
         :return:
         """
         print(order)
-        m = self.transform[order].GetMatrix()
+        m = self.get(order).GetMatrix()
         for i in range(0, 4):
             row = list()
             for j in range(0, 4):
@@ -628,7 +912,7 @@ class SliceOrder:
         Print all the homogenous matrices corresponding to the slice orders.
         :return:
         """
-        for k in self.transform.keys():
+        for k in _SLICE_ORDERS:
             self.print_transform(k)
 
     def get(self, order):
@@ -638,11 +922,16 @@ class SliceOrder:
         :param order: The slice order.
         :return: The vtkTransform to use.
         """
-        if order in self.transform.keys():
-            return self.transform[order]
-        else:
-            s = 'No such transform "{:s}" exists.'.format(order)
-            raise Exception(s)
+        if order not in self.transform:
+            if order not in _SLICE_ORDERS:
+                s = 'No such transform "{:s}" exists.'.format(order)
+                raise Exception(s)
+            mat = vtkMatrix4x4()
+            mat.DeepCopy(_SLICE_ORDERS[order].ravel().tolist())
+            trans = vtkTransform()
+            trans.SetMatrix(mat)
+            self.transform[order] = trans
+        return self.transform[order]
 
 
 def create_tissue_lut(indices, colors):
@@ -655,15 +944,17 @@ def create_tissue_lut(indices, colors):
     :param colors: The tissue name and color.
     :return: The lookup table.
     """
-    lut = vtkLookupTable()
-    lut.SetNumberOfColors(len(colors))
-    lut.SetTableRange(0, len(colors) - 1)
-    lut.Build()
-
     nc = vtkNamedColors()
 
-    for k in indices.keys():
-        lut.SetTableValue(indices[k], nc.GetColor4d(colors[k]))
+    # Fill the table in NumPy and set it in one call.
+    rgba = np.zeros((len(colors), 4), dtype=np.uint8)
+    for k, idx in indices.items():
+        rgba[idx] = nc.GetColor4ub(colors[k])
+
+    lut = vtkLookupTable()
+    lut.SetNumberOfTableValues(len(colors))
+    lut.SetTableRange(0, len(colors) - 1)
+    lut.SetTable(numpy_to_vtk(rgba, deep=True, array_type=VTK_UNSIGNED_CHAR))
 
     return lut
 
@@ -763,5 +1054,6 @@ def make_cube_actor(label_selector, colors):
 if __name__ == '__main__':
     import sys
 
-    data_folder, view, selected_tissues, use_flying_edges, use_decimate = get_program_parameters(sys.argv)
-    main(data_folder, view, selected_tissues, use_flying_edges, use_decimate)
+    data_folder, view, selected_tissues, use_flying_edges, use_decimate, use_discrete = get_program_parameters(
+        sys.argv)
+    main(data_folder, view, selected_tissues, use_flying_edges, use_decimate, use_discrete)
@@ -1,6 +1,8 @@
 #!/usr/bin/env python3
 
 import json
+import os
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 # noinspection PyUnresolvedReferences
@@ -12,11 +14,16 @@ from vtkmodules.vtkCommonCore import (
     vtkCommand,
     vtkLookupTable
 )
+from vtkmodules.vtkCommonDataModel import vtkMultiBlockDataSet
 from vtkmodules.vtkCommonMath import vtkMatrix4x4
 from vtkmodules.vtkCommonTransforms import vtkTransform
 from vtkmodules.vtkFiltersCore import vtkPolyDataNormals
 from vtkmodules.vtkFiltersGeneral import vtkTransformPolyDataFilter
 from vtkmodules.vtkIOLegacy import vtkPolyDataReader
+from vtkmodules.vtkIOXML import (
+    vtkXMLPolyDataReader,
+    vtkXMLPolyDataWriter
+)
 from vtkmodules.vtkInteractionStyle import vtkInteractorStyleTrackballCamera
 from vtkmodules.vtkInteractionWidgets import (
     vtkCameraOrientationWidget,
@@ -30,6 +37,8 @@ from vtkmodules.vtkRenderingAnnotation import (
 )
 from vtkmodules.vtkRenderingCore import (
     vtkActor,
+    vtkCompositeDataDisplayAttributes,
+    vtkCompositePolyDataMapper,
     vtkPolyDataMapper,
     vtkPropAssembly,
     vtkRenderWindow,
@@ -37,6 +46,8 @@ from vtkmodules.vtkRenderingCore import (
     vtkRenderer
 )
 
+# The names that select the brain, only one of them is used.
+_BRAIN_ALIASES = frozenset({'brain', 'brainbin'})
 
 def get_program_parameters(argv):
     import argparse
@@ -70,11 +81,13 @@ Note:
     parser.add_argument('file_name', help='The path to the JSON file e.g. Frog_vtk.json.')
     parser.add_argument('-n', action='store_true', dest='omit_sliders', help='No sliders.')
     parser.add_argument('-t', nargs='+', dest='tissues', action='append', help='Select one or more tissues.')
+    parser.add_argument('--cache', action='store_true', dest='use_cache',
+                        help='Cache the transformed surfaces in FroggieView_cache next to the JSON file.')
     args = parser.parse_args()
-    return args.file_name, args.view, args.omit_sliders, args.tissues
+    return args.file_name, args.view, args.omit_sliders, args.tissues, args.use_cache
 
 
-def main(fn, select_figure, no_sliders, chosen_tissues):
+def main(fn, select_figure, no_sliders, chosen_tissues, use_cache=False):
     if not select_figure:
         select_figure = 'p'
 
@@ -103,6 +116,7 @@ def main(fn, select_figure, no_sliders, chosen_tissues):
         chosen_tissues = [x.lower() for x in chosen_tissues[0]]
         res = list()
         has_brainbin = False
+        available = frozenset(tissues)
         if 'brainbin' in chosen_tissues:
             print('Using brainbin instead of brain.')
             res.append('brainbin')
@@ -112,9 +126,9 @@ def main(fn, select_figure, no_sliders, chosen_tissues):
             parameters['colors']['brainbin'] = 'beige'
             has_brainbin = True
         for ct in chosen_tissues:
-            if has_brainbin and ct in ['brain', 'brainbin']:
+            if has_brainbin and ct in _BRAIN_ALIASES:
                 continue
-            if ct in tissues:
+            if ct in available:
                 res.append(ct)
             else:
                 print(f'Tissue: {ct} is not available.')
@@ -124,6 +138,9 @@ def main(fn, select_figure, no_sliders, chosen_tissues):
             parameters['opacity']['skin'] = 1.0
         tissues = res
 
+    # Look up the tissue colors once, keyed by the tissue index.
+    rgb_cache = {idx: tuple(color_lut.GetTableValue(idx))[:3] for idx in parameters['indices'].values()}
+
     colors = vtkNamedColors()
     colors.SetColor("ParaViewBkg", [82, 87, 110, 255])
 
@@ -148,43 +165,96 @@ def main(fn, select_figure, no_sliders, chosen_tissues):
 
     slider_count = 0
 
-    color_size = len(max(parameters['colors'].values(), key=len))
-    name_size = len(max(parameters['names'], key=len))
+    color_size = max(map(len, parameters['colors'].values()))
+    name_size = max(map(len, parameters['names']))
     int_size = 2
     line = '-' * (7 + name_size + color_size)
     res = [line,
            f'{"Tissue":<{name_size}s}{" Label "}{"Color"}',
            line]
 
+    # If requested, the transformed surfaces with their normals are cached next to the JSON file.
+    #  A tissue file is only read if its cached surface is missing or older than the file.
+    cache_dir = None
+    if use_cache:
+        cache_dir = fn_path.parent / 'FroggieView_cache'
+        try:
+            cache_dir.mkdir(exist_ok=True)
+        except OSError:
+            cache_dir = None
+
+    # Read the files concurrently, the readers release the GIL while reading.
+    readers = dict()
+    cache_paths = dict()
+    cached = set()
     for tissue in tissues:
+        vtk_file = parameters['vtk_files'][tissue]
+        if cache_dir is not None:
+            cache_paths[tissue] = cache_dir / f'{tissue}_{parameters["orientation"][tissue]}.vtp'
+            if is_cache_current(cache_paths[tissue], vtk_file):
+                reader = vtkXMLPolyDataReader()
+                reader.SetFileName(cache_paths[tissue])
+                readers[tissue] = reader
+                cached.add(tissue)
+                continue
         reader = vtkPolyDataReader()
-        reader.SetFileName(parameters['vtk_files'][tissue])
-        reader.Update()
-
-        trans = SliceOrder().get(parameters['orientation'][tissue])
-        trans.Scale(1, -1, -1)
-
-        tf = vtkTransformPolyDataFilter()
-        tf.SetInputConnection(reader.GetOutputPort())
-        tf.SetTransform(trans)
-        tf.SetInputConnection(reader.GetOutputPort())
-
-        normals = vtkPolyDataNormals()
-        normals.SetInputConnection(tf.GetOutputPort())
-        normals.SetFeatureAngle(60.0)
+        reader.SetFileName(vtk_file)
+        readers[tissue] = reader
+    with ThreadPoolExecutor(max_workers=min(8, len(readers))) as executor:
+        futures = [executor.submit(reader.Update) if tissue in cached else executor.submit(read_surface, reader)
+                   for tissue, reader in readers.items()]
+        for future in futures:
+            future.result()
+
+    # The opaque tissues are drawn by one actor, each tissue is a block with its own color and opacity.
+    opaque_blocks = vtkMultiBlockDataSet()
+    opaque_attributes = vtkCompositeDataDisplayAttributes()
+
+    slice_order = SliceOrder()
+    for tissue in tissues:
+        reader = readers[tissue]
 
-        mapper = vtkPolyDataMapper()
-        mapper.SetInputConnection(normals.GetOutputPort())
+        if tissue in cached:
+            surface = reader.GetOutput()
+        else:
+            # Compose the scale with a copy so that the shared slice order transform is unchanged.
+            trans = vtkTransform()
+            trans.SetMatrix(slice_order.get(parameters['orientation'][tissue]).GetMatrix())
+            trans.Scale(1, -1, -1)
+
+            tf = vtkTransformPolyDataFilter()
+            tf.SetInputConnection(reader.GetOutputPort())
+            tf.SetTransform(trans)
+
+            normals = vtkPolyDataNormals()
+            normals.SetInputConnection(tf.GetOutputPort())
+            normals.SetFeatureAngle(60.0)
+            normals.Update()
+
+            surface = normals.GetOutput()
+            if tissue in cache_paths:
+                write_cached_surface(surface, cache_paths[tissue])
+
+        if parameters['opacity'][tissue] == 1.0:
+            block = surface
+            opaque_blocks.SetBlock(opaque_blocks.GetNumberOfBlocks(), block)
+            opaque_attributes.SetBlockColor(block, rgb_cache[parameters['indices'][tissue]])
+            opaque_attributes.SetBlockOpacity(block, 1.0)
+            cb = SliderBlockCallback(opaque_attributes, block)
+        else:
+            mapper = vtkPolyDataMapper()
+            mapper.SetInputData(surface)
 
-        actor = vtkActor()
-        actor.SetMapper(mapper)
+            actor = vtkActor()
+            actor.SetMapper(mapper)
 
-        actor.GetProperty().SetOpacity(parameters['opacity'][tissue])
-        actor.GetProperty().SetDiffuseColor(color_lut.GetTableValue(parameters['indices'][tissue])[:3])
-        actor.GetProperty().SetSpecular(0.2)
-        actor.GetProperty().SetSpecularPower(10)
+            actor.GetProperty().SetOpacity(parameters['opacity'][tissue])
+            actor.GetProperty().SetDiffuseColor(rgb_cache[parameters['indices'][tissue]])
+            actor.GetProperty().SetSpecular(0.2)
+            actor.GetProperty().SetSpecularPower(10)
 
-        ren.AddActor(actor)
+            ren.AddActor(actor)
+            cb = SliderCallback(actor.GetProperty())
 
         if not no_sliders:
             slider_properties = SliderProperties()
@@ -201,12 +271,10 @@ def main(fn, select_figure, no_sliders, chosen_tissues):
                 slider_properties.p2 = [right_pos_x1, right_pos_y]
                 right_pos_y += right_step_size
 
-            slider_widget = make_slider_widget(slider_properties, color_lut, parameters['indices'][tissue])
+            slider_widget = make_slider_widget(slider_properties, rgb_cache, parameters['indices'][tissue])
             slider_widget.SetInteractor(iren)
             slider_widget.SetAnimationModeToAnimate()
-            slider_widget.EnabledOn()
 
-            cb = SliderCallback(actor.GetProperty())
             slider_widget.AddObserver(vtkCommand.InteractionEvent, cb)
             sliders[tissue] = slider_widget
             slider_count += 1
@@ -218,6 +286,19 @@ def main(fn, select_figure, no_sliders, chosen_tissues):
     res.append(line)
     print('\n'.join(res))
 
+    if opaque_blocks.GetNumberOfBlocks():
+        mapper = vtkCompositePolyDataMapper()
+        mapper.SetInputDataObject(opaque_blocks)
+        mapper.SetCompositeDataDisplayAttributes(opaque_attributes)
+
+        actor = vtkActor()
+        actor.SetMapper(mapper)
+
+        actor.GetProperty().SetSpecular(0.2)
+        actor.GetProperty().SetSpecularPower(10)
+
+        ren.AddActor(actor)
+
     if no_sliders:
         ren_win.SetSize(1024, 1024)
     else:
@@ -226,6 +307,10 @@ def main(fn, select_figure, no_sliders, chosen_tissues):
 
     ren.SetBackground(colors.GetColor3d('ParaViewBkg'))
 
+    # Enable the sliders once the render window is set up.
+    for slider_widget in sliders.values():
+        slider_widget.EnabledOn()
+
     #  Final view.
     camera = ren.GetActiveCamera()
     # Superior Anterior Left
@@ -311,6 +396,60 @@ def main(fn, select_figure, no_sliders, chosen_tissues):
     iren.Start()
 
 
+def read_surface(reader):
+    """
+    Read the surface keeping only the geometry.
+
+    The normals are computed after the surface is transformed and the color comes from
+     the lookup table, so any point and cell data in the file is not used.
+
+    :param reader: The polydata reader.
+    :return:
+    """
+    reader.Update()
+    surface = reader.GetOutput()
+    surface.GetPointData().Initialize()
+    surface.GetCellData().Initialize()
+
+
+def is_cache_current(cache_path, vtk_file):
+    """
+    Check that the cached surface exists and is not older than the tissue file.
+
+    :param cache_path: The path to the cached surface.
+    :param vtk_file: The path to the tissue file.
+    :return: True if the cached surface can be used.
+    """
+    try:
+        return cache_path.stat().st_mtime >= vtk_file.stat().st_mtime
+    except OSError:
+        return False
+
+
+def write_cached_surface(surface, cache_path):
+    """
+    Write the surface to the cache.
+
+    The surface is written to a temporary file that then replaces the cached surface,
+     so that an interrupted write does not leave a partial file in the cache.
+
+    :param surface: The transformed surface with normals.
+    :param cache_path: The path to the cached surface.
+    :return:
+    """
+    tmp_path = cache_path.with_suffix('.tmp')
+    writer = vtkXMLPolyDataWriter()
+    writer.SetFileName(tmp_path)
+    writer.SetInputData(surface)
+    writer.SetDataModeToAppended()
+    writer.EncodeAppendedDataOff()
+    writer.SetCompressorTypeToLZ4()
+    if writer.Write():
+        os.replace(tmp_path, cache_path)
+    else:
+        tmp_path.unlink(missing_ok=True)
+
+
 def parse_json(fn_path):
     """
     Parse the JSON file selecting the components that we want.
@@ -342,10 +481,15 @@ def parse_json(fn_path):
                                 print(f'Expected seventeen file names.')
                                 paths_ok = False
                             # The stem of the file path becomes the key.
-                            path_map = dict()
-                            for p in list(map(lambda pp: root / pp, v[kk])):
-                                path_map[p.stem] = p
-                                if not p.is_file():
+                            path_map = {p.stem: p for p in (root / pp for pp in v[kk])}
+                            # List each directory once rather than checking each file.
+                            existing = set()
+                            for parent in {p.parent for p in path_map.values()}:
+                                if parent.is_dir():
+                                    with os.scandir(parent) as entries:
+                                        existing.update(parent / e.name for e in entries if e.is_file())
+                            for p in path_map.values():
+                                if p not in existing:
                                     paths_ok = False
                                     print(f'Not a file {p}')
                             if paths_ok:
@@ -667,13 +811,24 @@ class SliderProperties:
     bar_color = 'Black'
     bar_ends_color = 'Indigo'
 
+    # The colors are resolved once, when the class is made.
+    colors = vtkNamedColors()
+    title_color_rgb = tuple(colors.GetColor3d(title_color))
+    label_color_rgb = tuple(colors.GetColor3d(label_color))
+    value_color_rgb = tuple(colors.GetColor3d(value_color))
+    slider_color_rgb = tuple(colors.GetColor3d(slider_color))
+    selected_color_rgb = tuple(colors.GetColor3d(selected_color))
+    bar_color_rgb = tuple(colors.GetColor3d(bar_color))
+    bar_ends_color_rgb = tuple(colors.GetColor3d(bar_ends_color))
+    del colors
+
 
-def make_slider_widget(properties, lut, idx):
+def make_slider_widget(properties, rgb_cache, idx):
     """
     Make the slider widget.
 
     :param properties: The slider properties.
-    :param lut: The color lookup table.
+    :param rgb_cache: The tissue colors keyed by the tissue index.
     :param idx: The tissue index.
     :return: The slider widget.
     """
@@ -697,26 +852,25 @@ def make_slider_widget(properties, lut, idx):
     slider.SetTitleHeight(properties.title_height)
     slider.SetLabelHeight(properties.label_height)
 
-    colors = vtkNamedColors()
     # Set the colors of the slider components.
     # Change the color of the bar.
-    slider.GetTubeProperty().SetColor(colors.GetColor3d(properties.bar_color))
+    slider.GetTubeProperty().SetColor(properties.bar_color_rgb)
     # Change the color of the ends of the bar.
-    slider.GetCapProperty().SetColor(colors.GetColor3d(properties.bar_ends_color))
+    slider.GetCapProperty().SetColor(properties.bar_ends_color_rgb)
     # Change the color of the knob that slides.
-    slider.GetSliderProperty().SetColor(colors.GetColor3d(properties.slider_color))
+    slider.GetSliderProperty().SetColor(properties.slider_color_rgb)
     # Change the color of the knob when the mouse is held on it.
-    slider.GetSelectedProperty().SetColor(colors.GetColor3d(properties.selected_color))
+    slider.GetSelectedProperty().SetColor(properties.selected_color_rgb)
     # Change the color of the text displaying the value.
-    slider.GetLabelProperty().SetColor(colors.GetColor3d(properties.value_color))
+    slider.GetLabelProperty().SetColor(properties.value_color_rgb)
     #  Use the one color for the labels.
-    # slider.GetTitleProperty().SetColor(colors.GetColor3d(properties.label_color))
+    # slider.GetTitleProperty().SetColor(properties.label_color_rgb)
     # Change the color of the text indicating what the slider controls
-    if idx in range(0, 16):
-        slider.GetTitleProperty().SetColor(lut.GetTableValue(idx)[:3])
+    if idx in rgb_cache:
+        slider.GetTitleProperty().SetColor(rgb_cache[idx])
         slider.GetTitleProperty().ShadowOff()
     else:
-        slider.GetTitleProperty().SetColor(colors.GetColor3d(properties.title_color))
+        slider.GetTitleProperty().SetColor(properties.title_color_rgb)
 
     slider_widget = vtkSliderWidget()
     slider_widget.SetRepresentation(slider)
@@ -734,6 +888,17 @@ class SliderCallback:
         self.actor_property.SetOpacity(value)
 
 
+class SliderBlockCallback:
+    def __init__(self, attributes, block):
+        self.attributes = attributes
+        self.block = block
+
+    def __call__(self, caller, ev):
+        slider_widget = caller
+        value = slider_widget.GetRepresentation().GetValue()
+        self.attributes.SetBlockOpacity(self.block, value)
+
+
 class SliderToggleCallback:
     def __init__(self, sliders):
         self.sliders = sliders
@@ -750,5 +915,5 @@ class SliderToggleCallback:
 if __name__ == '__main__':
     import sys
 
-    data_folder, view, omit_sliders, selected_tissues = get_program_parameters(sys.argv)
-    main(data_folder, view, omit_sliders, selected_tissues)
+    data_folder, view, omit_sliders, selected_tissues, use_cache = get_program_parameters(sys.argv)
+    main(data_folder, view, omit_sliders, selected_tissues, use_cache)